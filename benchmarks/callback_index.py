@@ -0,0 +1,76 @@
+"""
+lookup cost of a pressed controller button with thousands of live controllers
+
+compares the old nested scan over every function of every stream with the
+flat PlayerFunctionIndex used by Bot._device_player_function
+
+    python -m benchmarks.callback_index --streams 3000 --functions 4
+"""
+
+import argparse
+import random
+import time
+import typing
+
+from smart_tv_telegram.bot import PlayerFunctionIndex
+from smart_tv_telegram.tools import secret_token
+
+
+def _nested_lookup(functions: typing.Dict[int, typing.Dict[int, typing.Any]], data: str):
+    function_id = int(data)
+
+    return next(
+        (f_v for f in functions.values() for f_k, f_v in f.items() if f_k == function_id),
+        None
+    )
+
+
+def _build(streams: int, per_stream: int):
+    nested: typing.Dict[int, typing.Dict[int, typing.Any]] = {}
+    index = PlayerFunctionIndex()
+    nested_data, index_data = [], []
+
+    for _ in range(streams):
+        local_token = secret_token()
+        functions = nested[local_token] = {}
+
+        for _ in range(per_stream):
+            function = object()
+            function_id = secret_token()
+            functions[function_id] = function
+            nested_data.append(str(function_id))
+            index_data.append(index.add(local_token, function))
+
+    return nested, nested_data, index, index_data
+
+
+def _bench(lookup: typing.Callable[[str], typing.Any], presses: typing.List[str]) -> float:
+    started = time.perf_counter()
+
+    for data in presses:
+        if lookup(data) is None:
+            raise AssertionError(f"{data} not found")
+
+    return (time.perf_counter() - started) / len(presses)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=3000)
+    parser.add_argument("--functions", type=int, default=4)
+    parser.add_argument("--presses", type=int, default=2000)
+    args = parser.parse_args()
+
+    nested, nested_data, index, index_data = _build(args.streams, args.functions)
+    picks = [random.randrange(len(nested_data)) for _ in range(args.presses)]
+
+    nested_time = _bench(lambda data: _nested_lookup(nested, data), [nested_data[i] for i in picks])
+    index_time = _bench(index.get, [index_data[i] for i in picks])
+
+    print(f"{len(index)} controllers ({args.streams} streams x {args.functions} functions)")
+    print(f"{'nested scan':>12}: {nested_time * 1e6:10.2f} us/press")
+    print(f"{'flat index':>12}: {index_time * 1e6:10.2f} us/press ({nested_time / index_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
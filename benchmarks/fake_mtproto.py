@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import random
+import time
+import typing
+
+from pyrogram.errors import FloodWait
+from pyrogram.raw.functions.upload import GetFile
+from pyrogram.raw.types import Message, MessageMediaDocument, Document, PeerUser, DocumentAttributeFilename
+from pyrogram.raw.types.storage import FileUnknown
+from pyrogram.raw.types.upload import File
+
+from smart_tv_telegram import Config, Mtproto
+from smart_tv_telegram.document_cache import DocumentMeta
+from smart_tv_telegram.download_accounts import DownloadAccount, ResolveDocumentType
+from smart_tv_telegram.session_pool import OnLatencyType
+
+__all__ = [
+    "FakeNetwork",
+    "FakeDownloadAccount",
+    "FakeMtproto"
+]
+
+_PATTERN_SIZE = 1024 * 1024 + 251
+
+
+class FakeNetwork:
+    latency: float
+    jitter: float
+    flood_probability: float
+    flood_wait: int
+    dc_ids: typing.List[int]
+    document_size: int
+    account_max_rate: float
+    requests: int
+    flood_waits: int
+    requested_bytes: int
+
+    def __init__(self,
+                 latency: float = 0.05,
+                 jitter: float = 0.02,
+                 flood_probability: float = 0.,
+                 flood_wait: int = 1,
+                 dc_ids: typing.Sequence[int] = (2, 4),
+                 document_size: int = 512 * 1024 * 1024,
+                 account_max_rate: float = 0.):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_probability = flood_probability
+        self.flood_wait = flood_wait
+        self.dc_ids = list(dc_ids)
+        self.document_size = document_size
+        # GetFile requests per second one account gets before a FloodWait, 0 for no quota
+        self.account_max_rate = account_max_rate
+        self.requests = 0
+        self.flood_waits = 0
+        self.requested_bytes = 0
+
+    def document_dc(self, message_id: int) -> int:
+        return self.dc_ids[message_id % len(self.dc_ids)]
+
+    def document_id(self, message_id: int) -> int:
+        return 1_000_000 + message_id
+
+    def message(self, message_id: int) -> Message:
+        document = Document(
+            id=self.document_id(message_id),
+            access_hash=0,
+            file_reference=b"",
+            date=0,
+            mime_type="video/mp4",
+            size=self.document_size,
+            dc_id=self.document_dc(message_id),
+            attributes=[DocumentAttributeFilename(file_name=f"synthetic_{message_id}.mp4")]
+        )
+
+        return Message(
+            id=message_id,
+            peer_id=PeerUser(user_id=1),
+            date=0,
+            message="",
+            media=MessageMediaDocument(document=document)
+        )
+
+    async def round_trip(self):
+        await asyncio.sleep(max(0., random.gauss(self.latency, self.jitter)))
+
+
+class _FakeMediaSessionPool:
+    _network: FakeNetwork
+    _pattern: bytes
+    _recent: typing.Deque[float]
+
+    def __init__(self, network: FakeNetwork, pattern: bytes):
+        self._network = network
+        self._pattern = pattern
+        self._recent = collections.deque()
+
+    def _over_quota(self) -> bool:
+        if not self._network.account_max_rate:
+            return False
+
+        now = time.monotonic()
+
+        while self._recent and self._recent[0] <= now - 1:
+            self._recent.popleft()
+
+        if len(self._recent) >= self._network.account_max_rate:
+            return True
+
+        self._recent.append(now)
+        return False
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def invoke(self, query: GetFile, on_latency: typing.Optional[OnLatencyType] = None) -> File:
+        network = self._network
+        network.requests += 1
+        started = time.monotonic()
+        await network.round_trip()
+
+        if self._over_quota() or random.random() < network.flood_probability:
+            network.flood_waits += 1
+            raise FloodWait(value=network.flood_wait)
+
+        if on_latency is not None:
+            on_latency(time.monotonic() - started)
+
+        limit = max(0, min(query.limit, network.document_size - query.offset))
+        start = query.offset % 251
+        network.requested_bytes += limit
+
+        return File(type=FileUnknown(), mtime=0, bytes=self._pattern[start:start + limit])
+
+
+class FakeDownloadAccount(DownloadAccount):
+    """a DownloadAccount of FakeNetwork, every account has its own GetFile quota"""
+
+    _pool: _FakeMediaSessionPool
+
+    def __init__(self, name: str, config: Config, network: FakeNetwork, resolve: ResolveDocumentType):
+        # noinspection PyTypeChecker
+        super().__init__(name, config, None, name, resolve)
+        self._pool = _FakeMediaSessionPool(network, bytes(i % 251 for i in range(_PATTERN_SIZE)))
+
+    async def _get_media_pool(self, dc_id: int) -> _FakeMediaSessionPool:
+        return self._pool
+
+    async def start(self):
+        pass
+
+
+class FakeMtproto(Mtproto):
+    """the real Mtproto with the telegram network replaced by FakeNetwork"""
+
+    _network: FakeNetwork
+    _relayed_documents: typing.Set[typing.Tuple[int, int]]
+
+    def __init__(self, config: Config, network: FakeNetwork):
+        self._network = network
+        self._relayed_documents = set()
+        super().__init__(config)
+
+    async def _get_messages(self, message_ids: typing.List[int]) -> typing.List[typing.Any]:
+        await self._network.round_trip()
+        return [self._network.message(message_id) for message_id in message_ids]
+
+    async def _resolve_relayed(self, index: int, document: DocumentMeta, refresh: bool) -> DocumentMeta:
+        # forward to the relay chat and channels.getMessages, once per helper and document
+        if refresh or (index, document.id) not in self._relayed_documents:
+            await self._network.round_trip()
+            await self._network.round_trip()
+            self._relayed_documents.add((index, document.id))
+
+        return document
+
+    def _create_main_account(self) -> DownloadAccount:
+        return FakeDownloadAccount("main", self._config, self._network, self._resolve_own)
+
+    def _create_helper_account(self, index: int, token: str) -> DownloadAccount:
+        async def resolve(document: DocumentMeta, refresh: bool) -> DocumentMeta:
+            return await self._resolve_relayed(index, document, refresh)
+
+        return FakeDownloadAccount(f"helper{index}", self._config, self._network, resolve)
+
+    async def health_check(self):
+        pass
+
+    async def start(self):
+        pass
@@ -0,0 +1,123 @@
+"""
+event loop overhead of the per-block stream inactivity tracking
+
+compares the old per-stream AsyncDebounce (one task cancelled and created
+for every block) with the shared InactivityWheel (one timestamp update)
+
+    python -m benchmarks.inactivity_timer --streams 50 --blocks 2000
+"""
+
+import argparse
+import asyncio
+import time
+import typing
+
+from smart_tv_telegram.tools import InactivityWheel
+
+
+# the timer smart_tv_telegram.tools used before InactivityWheel, kept here as the baseline
+async def _debounce_wrap(
+        function: typing.Callable[..., typing.Coroutine],
+        args: typing.Tuple[typing.Any],
+        timeout: int,
+):
+    await asyncio.sleep(timeout)
+    await function(*args)
+
+
+class AsyncDebounce:
+    _function: typing.Callable[..., typing.Coroutine]
+    _timeout: int
+    _task: typing.Optional[asyncio.Task] = None
+    _args: typing.Optional[typing.Tuple[typing.Any]] = None
+
+    def __init__(self, function: typing.Callable[..., typing.Coroutine], timeout: int):
+        self._function = function
+        self._timeout = timeout
+
+    def _run(self) -> bool:
+        if self._args is None:
+            return False
+
+        self._task = asyncio.get_event_loop().create_task(_debounce_wrap(self._function, self._args, self._timeout))
+        return True
+
+    def update_args(self, *args) -> bool:
+        if self._task is not None and self._task.done():
+            return False
+
+        if self._task is not None:
+            self._task.cancel()
+
+        self._args = args
+        return self._run()
+
+    def reschedule(self):
+        return self._run()
+
+
+async def _noop(*_):
+    pass
+
+
+async def _bench_debounce(streams: int, blocks: int, timeout: int) -> float:
+    debounces = [AsyncDebounce(_noop, timeout) for _ in range(streams)]
+    started = time.perf_counter()
+
+    for _ in range(blocks):
+        for stream_id, debounce in enumerate(debounces):
+            debounce.update_args(stream_id)
+
+        await asyncio.sleep(0)  # let the loop process the cancelled tasks, like a real stream write does
+
+    elapsed = time.perf_counter() - started
+
+    for debounce in debounces:
+        debounce.update_args(None)
+
+    return elapsed
+
+
+async def _bench_wheel(streams: int, blocks: int, timeout: int) -> float:
+    wheel = InactivityWheel(_noop, timeout)
+    wheel.start()
+    started = time.perf_counter()
+
+    for _ in range(blocks):
+        for stream_id in range(streams):
+            wheel.touch(stream_id)
+
+        await asyncio.sleep(0)
+
+    return time.perf_counter() - started
+
+
+async def _baseline(streams: int, blocks: int) -> float:
+    started = time.perf_counter()
+
+    for _ in range(blocks):
+        for _ in range(streams):
+            pass
+
+        await asyncio.sleep(0)
+
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--timeout", type=int, default=900)
+    args = parser.parse_args()
+
+    updates = args.streams * args.blocks
+    baseline = asyncio.run(_baseline(args.streams, args.blocks))
+
+    for name, bench in (("AsyncDebounce", _bench_debounce), ("InactivityWheel", _bench_wheel)):
+        elapsed = asyncio.run(bench(args.streams, args.blocks, args.timeout)) - baseline
+        print(f"{name:>16}: {elapsed / updates * 1e6:8.3f} us/block ({updates} blocks)")
+
+
+if __name__ == "__main__":
+    main()
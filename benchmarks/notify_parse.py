@@ -0,0 +1,132 @@
+"""
+cost of parsing the upnp NOTIFY bodies received from subscribed renderers
+
+compares the full parser (decode, html.unescape, ElementTree.iterparse) with
+the byte scan used by UpnpNotifyServer, on NOTIFY bodies shaped like the ones
+Samsung, LG and Sony renderers send
+
+the payloads are synthetic, written after the layout of those devices events
+(escaped LastChange, double escaped DIDL-Lite metadata, vendor namespaces),
+they are not captures of real traffic
+
+    python -m benchmarks.notify_parse --repeat 20000
+"""
+
+import argparse
+import html
+import time
+import typing
+
+from smart_tv_telegram.devices.upnp_device import _player_status, _player_status_full
+
+_DIDL = (
+    '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '
+    'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+    '<item id="R:0/0/0" parentID="R:0/0" restricted="true">'
+    '<dc:title>The Movie (2019) 1080p.mkv</dc:title>'
+    '<upnp:class>object.item.videoItem.movie</upnp:class>'
+    '<res protocolInfo="http-get:*:video/mp4:DLNA.ORG_OP=01;DLNA.ORG_CI=0;'
+    'DLNA.ORG_FLAGS=21700000000000000000000000000000">'
+    'http://192.168.1.10:8350/stream/1234/5678901234</res>'
+    '</item></DIDL-Lite>'
+)
+
+
+def _event(instance: str, namespace: str = "urn:schemas-upnp-org:metadata-1-0/AVT/") -> str:
+    return f'<Event xmlns="{namespace}"><InstanceID val="0">{instance}</InstanceID></Event>'
+
+
+def _propertyset(last_change: str, extra: str = "") -> bytes:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\r\n'
+        '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+        f'<e:property><LastChange>{html.escape(last_change)}</LastChange></e:property>'
+        f'{extra}'
+        '</e:propertyset>'
+    ).encode("utf8")
+
+
+def _samsung(state: str, status: str) -> bytes:
+    return _propertyset(_event(
+        f'<TransportState val="{state}"/>'
+        f'<TransportStatus val="{status}"/>'
+        '<CurrentPlayMode val="NORMAL"/>'
+        '<CurrentTrackDuration val="01:52:31"/>'
+        '<CurrentMediaDuration val="01:52:31"/>'
+        f'<CurrentTrackMetaData val="{html.escape(_DIDL)}"/>'
+        f'<AVTransportURIMetaData val="{html.escape(_DIDL)}"/>'
+        '<CurrentTransportActions val="Play,Stop,Pause,Seek"/>'
+    ))
+
+
+def _lg(state: str, status: str) -> bytes:
+    return _propertyset(_event(
+        f'<TransportState val="{state}"/>'
+        f'<TransportStatus val="{status}"/>'
+        '<NumberOfTracks val="1"/>'
+        '<CurrentTrack val="1"/>'
+        f'<CurrentTrackMetaData val="{html.escape(_DIDL)}"/>'
+    ))
+
+
+def _sony(state: str, status: str) -> bytes:
+    # vendor namespace for the extra variables, single quoted values
+    return _propertyset(_event(
+        f"<TransportState val='{state}'/>"
+        f"<TransportStatus val='{status}'/>"
+        "<TransportPlaySpeed val='1'/>"
+        '<avt-sony:X_DLNA_SeekTime xmlns:avt-sony="urn:schemas-sony-com:av" val="REL_TIME"/>'
+        f"<AVTransportURIMetaData val='{html.escape(_DIDL, quote=False)}'/>"
+    ))
+
+
+def _volume_only() -> bytes:
+    # RenderingControl events reach the same handler and carry no transport status
+    return _propertyset(_event(
+        '<Volume channel="Master" val="12"/><Mute channel="Master" val="0"/>',
+        "urn:schemas-upnp-org:metadata-1-0/RCS/"
+    ))
+
+
+def _corpus() -> typing.List[typing.Tuple[str, bytes]]:
+    corpus = [("rcs volume", _volume_only())]
+
+    for vendor, build in (("samsung", _samsung), ("lg", _lg), ("sony", _sony)):
+        corpus.append((f"{vendor} playing", build("PLAYING", "OK")))
+        corpus.append((f"{vendor} stopped", build("STOPPED", "STOPPED")))
+        corpus.append((f"{vendor} error", build("STOPPED", "ERROR_OCCURRED")))
+
+    return corpus
+
+
+def _bench(parser: typing.Callable[[bytes], typing.Any], payload: bytes, repeat: int) -> float:
+    started = time.perf_counter()
+
+    for _ in range(repeat):
+        parser(payload)
+
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'payload':>16} {'bytes':>6} {'full parser':>12} {'byte scan':>10} {'speedup':>8}")
+
+    for name, payload in _corpus():
+        expected = _player_status_full(payload)
+        status = _player_status(payload)
+
+        if status != expected:
+            raise AssertionError(f"{name}: byte scan returned {status}, full parser {expected}")
+
+        full = _bench(_player_status_full, payload, args.repeat)
+        fast = _bench(_player_status, payload, args.repeat)
+        print(f"{name:>16} {len(payload):>6} {full * 1e6:>9.2f} us {fast * 1e6:>7.2f} us {full / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
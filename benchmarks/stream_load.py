@@ -0,0 +1,327 @@
+"""
+load test of the http streaming path against a fake telegram network
+
+the server (Http + Mtproto with FakeNetwork) runs in this process, the range
+clients run in a child process so they do not pollute the loop lag numbers
+
+with --workers the ranges are served by that many http worker processes
+(StreamWorkers), the loop lag is then the one of the mtproto process
+
+    python -m benchmarks.stream_load --clients 20 --pattern seek --duration 30
+    python -m benchmarks.stream_load --clients 40 --workers 4
+    python -m benchmarks.stream_load --clients 20 --account-max-rate 20 --helpers 2
+"""
+
+import argparse
+import asyncio
+import configparser
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import tempfile
+import time
+import typing
+
+import aiohttp
+
+from smart_tv_telegram import Config, Http, DeviceFinderCollection, StreamWorkers
+from smart_tv_telegram.tools import secret_token
+from .fake_mtproto import FakeMtproto, FakeNetwork
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _write_config(path: str, port: int, workers_port: int, args: argparse.Namespace):
+    config = configparser.ConfigParser()
+    config["mtproto"] = {
+        "api_id": "1",
+        "api_hash": "0" * 32,
+        "token": "0:benchmark",
+        "session_name": os.path.join(os.path.dirname(path), "benchmark"),
+        "file_fake_fw_wait": "0.2",
+        "governor_enabled": str(int(args.governor)),
+        "governor_max_rate": str(args.governor_max_rate),
+        "helper_tokens": repr([f"{index}:helper" for index in range(args.helpers)]),
+        "helper_relay_chat": "-1001"
+    }
+    config["bot"] = {
+        "admins": "[]",
+        "block_size": str(args.block_size),
+        "first_window_size": str(args.first_window_size),
+        "read_ahead_depth": str(args.read_ahead_depth),
+        "read_ahead_max_memory": str(args.read_ahead_depth * args.block_size),
+        "request_gone_timeout": "900"
+    }
+    config["cache"] = {
+        "memory_max_size": str(args.memory_cache_size)
+    }
+    config["http"] = {
+        "listen_host": "127.0.0.1",
+        "listen_port": str(port),
+        "send_buffer_size": str(args.send_buffer_size),
+        "workers": str(args.workers),
+        "workers_port": str(workers_port)
+    }
+    config["web_ui"] = {
+        "enabled": "0"
+    }
+    config["discovery"] = {
+        "upnp_enabled": "0",
+        "chromecast_enabled": "0",
+        "xbmc_enabled": "0",
+        "vlc_enabled": "0",
+        "device_request_timeout": "10"
+    }
+
+    with open(path, "w") as file:
+        config.write(file)
+
+
+def _percentile(values: typing.List[float], percent: float) -> float:
+    if not values:
+        return float("nan")
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _current_rss() -> int:
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _ClientStats:
+    received: int
+    ttfb: typing.List[float]
+    errors: int
+
+    def __init__(self):
+        self.received = 0
+        self.ttfb = []
+        self.errors = 0
+
+
+async def _read_range(session: aiohttp.ClientSession, url: str, stats: _ClientStats, start: int, length: int):
+    started = time.perf_counter()
+    first = True
+
+    try:
+        async with session.get(url, headers={"Range": f"bytes={start}-"}) as response:
+            if response.status not in (200, 206):
+                stats.errors += 1
+                return
+
+            remains = length
+
+            async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                if first:
+                    stats.ttfb.append(time.perf_counter() - started)
+                    first = False
+
+                stats.received += len(chunk)
+                remains -= len(chunk)
+
+                if remains <= 0:
+                    break
+
+    except aiohttp.ClientError:
+        stats.errors += 1
+
+
+async def _linear_client(session: aiohttp.ClientSession, url: str, size: int, args, deadline: float, stats):
+    while time.monotonic() < deadline:
+        await _read_range(session, url, stats, 0, min(size, args.read_size))
+
+
+async def _seek_client(session: aiohttp.ClientSession, url: str, size: int, args, deadline: float, stats):
+    # what dlna renderers do on open: HEAD, header probe, index probe at the end, then playback with seeks
+    async with session.head(url) as response:
+        await response.release()
+
+    await _read_range(session, url, stats, 0, 256 * 1024)
+    await _read_range(session, url, stats, max(0, size - 65536), 65536)
+
+    while time.monotonic() < deadline:
+        await _read_range(session, url, stats, random.randrange(0, size - args.read_size), args.read_size)
+
+
+async def _run_clients(base_url: str, urls: typing.List[str], size: int, args) -> typing.Dict[str, typing.Any]:
+    client = _seek_client if args.pattern == "seek" else _linear_client
+    deadline = time.monotonic() + args.duration
+    stats = [_ClientStats() for _ in urls]
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async with aiohttp.ClientSession(base_url, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session, url, size, args, deadline, x) for url, x in zip(urls, stats)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed": elapsed,
+        "received": sum(x.received for x in stats),
+        "ttfb": [ttfb for x in stats for ttfb in x.ttfb],
+        "errors": sum(x.errors for x in stats)
+    }
+
+
+def _client_process(queue: multiprocessing.Queue, base_url: str, urls: typing.List[str], size: int, args):
+    queue.put(asyncio.run(_run_clients(base_url, urls, size, args)))
+
+
+async def _monitor_loop_lag(lags: typing.List[float], interval: float = 0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def _monitor_rss(samples: typing.List[int], interval: float = 0.25):
+    while True:
+        samples.append(_current_rss())
+        await asyncio.sleep(interval)
+
+
+async def _wait_listening(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+
+        except ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+
+            await asyncio.sleep(0.1)
+
+
+async def _benchmark(args: argparse.Namespace):
+    port = _free_port()
+    workers_port = _free_port()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = os.path.join(workdir, "config.ini")
+        _write_config(config_path, port, workers_port, args)
+        config = Config(config_path)
+
+    network = FakeNetwork(
+        latency=args.latency,
+        jitter=args.jitter,
+        flood_probability=args.flood_probability,
+        flood_wait=args.flood_wait,
+        dc_ids=args.dc_ids,
+        document_size=args.document_size,
+        account_max_rate=args.account_max_rate
+    )
+
+    mtproto = FakeMtproto(config, network)
+    http = Http(mtproto, config, DeviceFinderCollection())
+    workers = None
+
+    if config.http.workers.processes:
+        workers = StreamWorkers(mtproto, config, http)
+        http.set_session_observer(workers)
+        await workers.start()
+
+    server = asyncio.create_task(http.start())
+    await _wait_listening(config.http.stream_port)
+
+    urls = []
+
+    for client_id in range(args.clients):
+        message_id = 1 + client_id % args.documents
+        token = secret_token()
+        http.add_remote_token(message_id, token, 1)
+        urls.append(f"/stream/{message_id}/{token}")
+
+    lags: typing.List[float] = []
+    rss: typing.List[int] = []
+    monitors = [asyncio.create_task(_monitor_loop_lag(lags)), asyncio.create_task(_monitor_rss(rss))]
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    base_url = f"http://127.0.0.1:{config.http.stream_port}"
+    process = context.Process(target=_client_process, args=(queue, base_url, urls, args.document_size, args))
+    process.start()
+
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, queue.get)
+    await loop.run_in_executor(None, process.join)
+
+    for task in monitors + [server]:
+        task.cancel()
+
+    if workers is not None:
+        workers.close()
+        await asyncio.sleep(0.1)
+
+    megabytes = result["received"] / 1024 / 1024
+    ttfb = result["ttfb"]
+
+    print(f"clients={args.clients} workers={args.workers} pattern={args.pattern} documents={args.documents} "
+          f"latency={args.latency}s jitter={args.jitter}s flood_probability={args.flood_probability}")
+    print(f"throughput:   {megabytes / result['elapsed']:.2f} MB/s ({megabytes:.1f} MB in {result['elapsed']:.1f}s)")
+    print(f"ttfb:         p50={_percentile(ttfb, 50) * 1000:.1f}ms p90={_percentile(ttfb, 90) * 1000:.1f}ms "
+          f"p99={_percentile(ttfb, 99) * 1000:.1f}ms ({len(ttfb)} requests, {result['errors']} errors)")
+    print(f"loop lag:     p50={_percentile(lags, 50) * 1000:.2f}ms p99={_percentile(lags, 99) * 1000:.2f}ms "
+          f"max={max(lags, default=0) * 1000:.2f}ms")
+    print(f"rss:          peak={max(rss, default=0) / 1024 / 1024:.1f} MB "
+          f"mean={statistics.mean(rss) / 1024 / 1024 if rss else 0:.1f} MB")
+    print(f"telegram:     {network.requests} GetFile, {network.flood_waits} FloodWait, "
+          f"{network.requested_bytes / 1024 / 1024:.1f} MB fetched")
+
+    for name, state in mtproto.get_accounts_state().items():
+        print(f"{name + ':':<13} {state['requests']} blocks, {state['flood_waits']} FloodWait, "
+              f"{state['downloaded'] / 1024 / 1024:.1f} MB, {state['errors']} errors")
+
+
+def _arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pattern", choices=["linear", "seek"], default="linear")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--read-size", type=int, default=16 * 1024 * 1024)
+    parser.add_argument("--document-size", type=int, default=512 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--flood-probability", type=float, default=0.)
+    parser.add_argument("--flood-wait", type=int, default=1)
+    parser.add_argument("--dc-ids", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--block-size", type=int, default=1024 * 1024)
+    parser.add_argument("--first-window-size", type=int, default=64 * 1024)
+    parser.add_argument("--read-ahead-depth", type=int, default=4)
+    parser.add_argument("--memory-cache-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--send-buffer-size", type=int, default=256 * 1024)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--governor", type=int, choices=[0, 1], default=1)
+    parser.add_argument("--governor-max-rate", type=float, default=50)
+    parser.add_argument("--helpers", type=int, default=0)
+    parser.add_argument("--account-max-rate", type=float, default=0.)
+    return parser
+
+
+def main():
+    asyncio.run(_benchmark(_arg_parser().parse_args()))
+
+
+if __name__ == "__main__":
+    main()
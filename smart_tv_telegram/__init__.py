@@ -1,7 +1,8 @@
 from .config import Config
 from .mtproto import Mtproto
 from .devices_collection import DeviceFinderCollection
-from .http_server import Http, OnStreamClosed
+from .http_server import Http, OnStreamClosed, StreamSessionObserver
+from .stream_workers import StreamWorkers
 from .bot import Bot
 
 __version__ = "1.4.0"
@@ -14,6 +15,8 @@ __all__ = [
     "Mtproto",
     "Http",
     "OnStreamClosed",
+    "StreamSessionObserver",
+    "StreamWorkers",
     "Bot",
     "__version__",
     "__version_info__",
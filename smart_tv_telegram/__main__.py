@@ -8,7 +8,7 @@ import traceback
 import typing
 import urllib.request
 
-from smart_tv_telegram import Http, Mtproto, Config, Bot, DeviceFinderCollection
+from smart_tv_telegram import Http, Mtproto, Config, Bot, DeviceFinderCollection, StreamWorkers
 from smart_tv_telegram.devices import UpnpDeviceFinder, ChromecastDeviceFinder, VlcDeviceFinder, \
     WebDeviceFinder, XbmcDeviceFinder
 
@@ -37,8 +37,26 @@ async def async_main(config: Config, devices: DeviceFinderCollection):
     http.set_on_stream_closed_handler(bot.get_on_stream_closed())
     bot.prepare()
 
-    await mtproto.start()
-    await http.start()
+    await devices.start(config)
+
+    try:
+        await mtproto.start()
+
+        if not config.http.workers.processes:
+            await http.start()
+            return
+
+        workers = StreamWorkers(mtproto, config, http)
+        http.set_session_observer(workers)
+
+        try:
+            await workers.start()
+            await http.start()
+        finally:
+            workers.close()
+
+    finally:
+        await devices.stop(config)
 
 
 def main(config: Config, devices: DeviceFinderCollection):
@@ -0,0 +1,222 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import pickle
+import re
+import typing
+
+__all__ = [
+    "DiskBlockCache",
+    "MemoryBlockCache",
+    "SingleFlight",
+    "BlockKeyType"
+]
+
+BlockKeyType = typing.Tuple[int, int]
+_T = typing.TypeVar("_T")
+
+_LOGGER = logging.getLogger(__name__)
+_INDEX_FILENAME = "index.pickle"
+# the cache never shares a directory with the user's files, disk_path may be the app directory
+_SUBDIRECTORY = "blocks"
+_OWNED_FILENAME = re.compile(r"^(?:-?\d+_\d+|.+\.tmp)$")
+
+
+def _read_file(path: str) -> typing.Optional[bytes]:
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_file(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+
+    os.replace(tmp_path, path)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class DiskBlockCache:
+    _path: str
+    _max_size: int
+    _size: int
+    _index: typing.OrderedDict[BlockKeyType, int]
+    _writing: typing.Set[BlockKeyType]
+    _tasks: typing.Set[asyncio.Task]
+    _commit_lock: asyncio.Lock
+
+    def __init__(self, path: str, max_size: int):
+        self._path = os.path.join(path, _SUBDIRECTORY)
+        self._max_size = max_size
+        self._size = 0
+        self._index = collections.OrderedDict()
+        self._writing = set()
+        self._tasks = set()
+        self._commit_lock = asyncio.Lock()
+
+        os.makedirs(self._path, exist_ok=True)
+        self._load_index()
+
+    def _block_path(self, key: BlockKeyType) -> str:
+        return os.path.join(self._path, f"{key[0]}_{key[1]}")
+
+    def _index_path(self) -> str:
+        return os.path.join(self._path, _INDEX_FILENAME)
+
+    def _load_index(self):
+        index: typing.OrderedDict[BlockKeyType, int] = collections.OrderedDict()
+
+        if os.path.exists(self._index_path()):
+            try:
+                with open(self._index_path(), "rb") as file:
+                    index = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                _LOGGER.warning("block cache index corrupted, starting cold")
+
+        known_files = set()
+
+        for key, size in index.items():
+            block_path = self._block_path(key)
+
+            if os.path.isfile(block_path) and os.path.getsize(block_path) == size:
+                self._index[key] = size
+                self._size += size
+                known_files.add(os.path.basename(block_path))
+
+        for filename in os.listdir(self._path):
+            if filename in known_files or not _OWNED_FILENAME.match(filename):
+                continue
+
+            file_path = os.path.join(self._path, filename)
+
+            if os.path.isfile(file_path):
+                _remove_file(file_path)
+
+        for path in self._evict():
+            _remove_file(path)
+
+    def _evict(self) -> typing.List[str]:
+        removed = []
+
+        while self._index and self._size > self._max_size:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            removed.append(self._block_path(key))
+
+        return removed
+
+    def _commit(self, removed: typing.List[str], index: bytes):
+        for path in removed:
+            _remove_file(path)
+
+        _write_file(self._index_path(), index)
+
+    async def get(self, document_id: int, offset: int) -> typing.Optional[bytes]:
+        key = (document_id, offset)
+
+        if key not in self._index:
+            return None
+
+        self._index.move_to_end(key)
+        block = await asyncio.get_event_loop().run_in_executor(None, _read_file, self._block_path(key))
+
+        if block is None and key in self._index:
+            self._size -= self._index.pop(key)
+
+        return block
+
+    def put(self, document_id: int, offset: int, block: bytes):
+        key = (document_id, offset)
+
+        if key in self._index or key in self._writing or len(block) > self._max_size:
+            return
+
+        self._writing.add(key)
+        task = asyncio.get_event_loop().create_task(self._put(key, block))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _put(self, key: BlockKeyType, block: bytes):
+        loop = asyncio.get_event_loop()
+
+        try:
+            await loop.run_in_executor(None, _write_file, self._block_path(key), block)
+        except OSError:
+            _LOGGER.exception("unable to write block %s to cache", key)
+            return
+        finally:
+            self._writing.discard(key)
+
+        self._index[key] = len(block)
+        self._size += len(block)
+
+        async with self._commit_lock:
+            removed = self._evict()
+            index = pickle.dumps(self._index)
+            await loop.run_in_executor(None, self._commit, removed, index)
+
+
+class MemoryBlockCache:
+    _max_size: int
+    _size: int
+    _blocks: typing.OrderedDict[typing.Hashable, bytes]
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._size = 0
+        self._blocks = collections.OrderedDict()
+
+    def get(self, key: typing.Hashable) -> typing.Optional[bytes]:
+        block = self._blocks.get(key)
+
+        if block is not None:
+            self._blocks.move_to_end(key)
+
+        return block
+
+    def put(self, key: typing.Hashable, block: bytes):
+        if key in self._blocks or len(block) > self._max_size:
+            return
+
+        self._blocks[key] = block
+        self._size += len(block)
+
+        while self._size > self._max_size:
+            _, evicted = self._blocks.popitem(last=False)
+            self._size -= len(evicted)
+
+
+class SingleFlight:
+    _pending: typing.Dict[typing.Hashable, asyncio.Future]
+
+    def __init__(self):
+        self._pending = {}
+
+    def _done(self, key: typing.Hashable, future: asyncio.Future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+
+        if not future.cancelled():
+            future.exception()  # avoid "exception was never retrieved" when every waiter is gone
+
+    async def run(self, key: typing.Hashable, factory: typing.Callable[[], typing.Awaitable[_T]]) -> _T:
+        future = self._pending.get(key)
+
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(functools.partial(self._done, key))
+
+        # a waiter leaving (closed connection) must not cancel the request for the others
+        return await asyncio.shield(future)
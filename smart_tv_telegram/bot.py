@@ -1,7 +1,6 @@
 import abc
 import asyncio
 import enum
-import functools
 import html
 import sys
 import traceback
@@ -15,19 +14,21 @@ else:
 from pyrogram import Client, filters
 from pyrogram.filters import create
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
-from pyrogram.types import ReplyKeyboardRemove, Message, KeyboardButton, ReplyKeyboardMarkup, CallbackQuery, \
-    InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from . import Config, Mtproto, Http, OnStreamClosed, DeviceFinderCollection
-from .devices import Device, DevicePlayerFunction
+from .devices import Device, DeviceFinder, DevicePlayerFunction, OnDeviceFoundType
 from .tools import build_uri, pyrogram_filename, secret_token
 
 __all__ = [
     "Bot"
 ]
 
-_REMOVE_KEYBOARD = ReplyKeyboardRemove()
 _CANCEL_BUTTON = "^Cancel"
+_SELECT_PREFIX = "select"
+_SELECT_CANCEL = "cancel"
+_FIRST_RESULTS_WAIT = 0.5
+_KEYBOARD_EDIT_INTERVAL = 1.
 
 
 class States(enum.Enum):
@@ -55,22 +56,57 @@ class SelectStateData(StateData):
         self.devices = devices
 
 
+class PlayerFunctionIndex:
+    _functions: typing.Dict[int, typing.Tuple[DevicePlayerFunction, int]]
+    _streams: typing.Dict[int, typing.List[int]]
+
+    def __init__(self):
+        self._functions = {}
+        self._streams = {}
+
+    def __len__(self) -> int:
+        return len(self._functions)
+
+    def add(self, local_token: int, function: DevicePlayerFunction) -> str:
+        function_id = secret_token()
+        self._functions[function_id] = (function, local_token)
+        self._streams.setdefault(local_token, []).append(function_id)
+        return f"{local_token}:{function_id}"
+
+    def get(self, data: str) -> typing.Optional[DevicePlayerFunction]:
+        local_token, _, function_id = data.partition(":")
+
+        try:
+            function, owner = self._functions[int(function_id)]
+        except (KeyError, ValueError):
+            return None
+
+        # the stream is part of the callback data, a button of a closed or different stream never matches
+        if str(owner) != local_token:
+            return None
+
+        return function
+
+    def remove_stream(self, local_token: int):
+        for function_id in self._streams.pop(local_token, ()):
+            del self._functions[function_id]
+
+
 class OnStreamClosedHandler(OnStreamClosed):
     _mtproto: Mtproto
-    _functions: typing.Dict[int, typing.Any]
+    _functions: PlayerFunctionIndex
     _devices: typing.Dict[int, Device]
 
     def __init__(self,
                  mtproto: Mtproto,
-                 functions: typing.Dict[int, typing.Any],
+                 functions: PlayerFunctionIndex,
                  devices: typing.Dict[int, Device]):
         self._mtproto = mtproto
         self._functions = functions
         self._devices = devices
 
     async def handle(self, remains: float, chat_id: int, message_id: int, local_token: int):
-        if local_token in self._functions:
-            del self._functions[local_token]
+        self._functions.remove_stream(local_token)
 
         on_close: typing.Optional[typing.Callable[[int], typing.Coroutine]] = None
 
@@ -91,7 +127,8 @@ class TelegramStateMachine:
     def __init__(self):
         self._states = {}
 
-    def get_state(self, message: Message) -> typing.Tuple[States, typing.Union[bool, StateData]]:
+    def get_state(self,
+                  message: typing.Union[Message, CallbackQuery]) -> typing.Tuple[States, typing.Union[bool, StateData]]:
         user_id = message.from_user.id
 
         if user_id in self._states:
@@ -99,7 +136,10 @@ class TelegramStateMachine:
 
         return States.NOTHING, False
 
-    def set_state(self, message: Message, state: States, data: typing.Union[bool, StateData]) -> bool:
+    def set_state(self,
+                  message: typing.Union[Message, CallbackQuery],
+                  state: States,
+                  data: typing.Union[bool, StateData]) -> bool:
         if isinstance(data, bool) or data.get_associated_state() == state:
             self._states[message.from_user.id] = (state, data)
             return True
@@ -113,7 +153,7 @@ class Bot:
     _mtproto: Mtproto
     _http: Http
     _finders: DeviceFinderCollection
-    _functions: typing.Dict[int, typing.Dict[int, DevicePlayerFunction]]
+    _functions: PlayerFunctionIndex
     _devices: typing.Dict[int, Device]
 
     def __init__(self, mtproto: Mtproto, config: Config, http: Http, finders: DeviceFinderCollection):
@@ -122,7 +162,7 @@ class Bot:
         self._http = http
         self._finders = finders
         self._state_machine = TelegramStateMachine()
-        self._functions = {}
+        self._functions = PlayerFunctionIndex()
         self._devices = {}
 
     def get_on_stream_closed(self) -> OnStreamClosed:
@@ -138,27 +178,14 @@ class Bot:
         self._mtproto.register(MessageHandler(self._new_document, filters.video_note & admin_filter))
 
         admin_filter_inline = create(lambda _, __, m: m.from_user.id in self._config.admins)
+        select_filter = filters.regex(f"^{_SELECT_PREFIX}:")
+        self._mtproto.register(CallbackQueryHandler(self._select_device, select_filter & admin_filter_inline))
         self._mtproto.register(CallbackQueryHandler(self._device_player_function, admin_filter_inline))
 
-        state_filter = create(lambda _, __, m: self._state_machine.get_state(m)[0] == States.SELECT)
-        self._mtproto.register(MessageHandler(self._select_device, filters.text & admin_filter & state_filter))
-
     async def _device_player_function(self, _: Client, message: CallbackQuery):
-        data = message.data
+        device_function = self._functions.get(message.data)
 
-        try:
-            data = int(data)
-        except ValueError:
-            await message.answer("wrong callback")
-
-        try:
-            device_function = next(
-                f_v
-                for f in self._functions.values()
-                for f_k, f_v in f.items()
-                if f_k == data
-            )
-        except StopIteration:
+        if device_function is None:
             await message.answer("stream closed")
             return
 
@@ -174,30 +201,39 @@ class Bot:
         else:
             await message.answer("done")
 
-    async def _select_device(self, _: Client, message: Message):
-        data: SelectStateData
-        _, data = self._state_machine.get_state(message)
+    async def _select_device(self, _: Client, callback: CallbackQuery):
+        _, msg_id, choice = callback.data.split(":", 2)
+        state, data = self._state_machine.get_state(callback)
+
+        if state != States.SELECT or str(data.msg_id) != msg_id:
+            await callback.answer("selection expired")
+            return
 
-        self._state_machine.set_state(message, States.NOTHING, False)
-        reply = functools.partial(message.reply, reply_markup=_REMOVE_KEYBOARD)
+        data: SelectStateData
+        self._state_machine.set_state(callback, States.NOTHING, False)
 
-        if message.text == _CANCEL_BUTTON:
-            await reply("Cancelled")
+        if choice == _SELECT_CANCEL:
+            await callback.message.edit_text("Cancelled")
+            await callback.answer()
             return
 
         try:
-            device = next(
-                device
-                for device in data.devices
-                if repr(device) == message.text
-            )
-        except StopIteration:
-            await reply("Wrong device")
+            device = data.devices[int(choice)]
+        except (ValueError, IndexError):
+            await callback.message.edit_text("Wrong device")
+            await callback.answer()
             return
 
+        await callback.message.edit_text(f"Selected device <code>{html.escape(device.get_device_name())}</code>")
+        await callback.answer()
+        await self._play(callback.message, data, device)
+
+    async def _play(self, message: Message, data: SelectStateData, device: Device):
+        reply = message.reply
+
         async with timeout(self._config.device_request_timeout) as timeout_context:
             token = secret_token()
-            local_token = self._http.add_remote_token(data.msg_id, token)
+            local_token = self._http.add_remote_token(data.msg_id, token, message.chat.id)
             uri = build_uri(self._config, data.msg_id, token)
 
             # noinspection PyBroadException
@@ -207,6 +243,7 @@ class Bot:
 
             except Exception as ex:
                 traceback.print_exc()
+                self._http.remove_remote_token(local_token)
 
                 await reply(
                     "Error while communicate with the device:\n\n"
@@ -216,65 +253,113 @@ class Bot:
             else:
                 self._devices[local_token] = device
                 physical_functions = device.get_player_functions()
-                functions = self._functions[local_token] = {}
 
                 if physical_functions:
                     buttons = []
 
                     for function in physical_functions:
-                        function_id = secret_token()
                         function_name = await function.get_name()
-                        button = InlineKeyboardButton(function_name, str(function_id))
-                        functions[function_id] = function
+                        button = InlineKeyboardButton(function_name, self._functions.add(local_token, function))
                         buttons.append([button])
 
-                    await message.reply(
+                    await reply(
                         f"Device <code>{html.escape(device.get_device_name())}</code>\n"
                         f"controller for file <code>{data.msg_id}</code>",
                         reply_markup=InlineKeyboardMarkup(buttons)
                     )
 
-                    stub_message = await reply("stub")
-                    await stub_message.delete()
-
                 else:
                     await reply(f"Playing file <code>{data.msg_id}</code>")
 
         if timeout_context.expired():
             await reply("Timeout while communicate with the device")
 
+    @staticmethod
+    def _build_select_markup(data: SelectStateData) -> InlineKeyboardMarkup:
+        buttons = [
+            [InlineKeyboardButton(repr(device), f"{_SELECT_PREFIX}:{data.msg_id}:{index}")]
+            for index, device in enumerate(data.devices)
+        ]
+
+        buttons.append([InlineKeyboardButton(_CANCEL_BUTTON, f"{_SELECT_PREFIX}:{data.msg_id}:{_SELECT_CANCEL}")])
+        return InlineKeyboardMarkup(buttons)
+
+    async def _find_each(self, finder: DeviceFinder, on_found: OnDeviceFoundType):
+        # noinspection PyBroadException
+        try:
+            await finder.find_each(self._config, on_found)
+        except Exception:
+            traceback.print_exc()
+
     async def _new_document(self, _: Client, message: Message):
-        self._state_machine.set_state(message, States.NOTHING, False)
+        try:
+            filename = pyrogram_filename(message)
+        except TypeError:
+            filename = "None"
 
-        devices = []
+        data = SelectStateData(message.id, str(filename), [])
+        self._state_machine.set_state(message, States.SELECT, data)
 
-        for finder in self._finders.get_finders(self._config):
-            try:
-                async with timeout(self._config.device_request_timeout + 1):
-                    devices.extend(await finder.find(self._config))
-            except asyncio.CancelledError:
-                pass
+        found = asyncio.Event()
 
-        if devices:
-            try:
-                filename = pyrogram_filename(message)
-            except TypeError:
-                filename = "None"
-
-            self._state_machine.set_state(
-                message,
-                States.SELECT,
-                SelectStateData(
-                    message.id,
-                    str(filename),
-                    devices.copy()
-                )
-            )
+        def on_found(device: Device):
+            data.devices.append(device)
+            found.set()
 
-            buttons = [[KeyboardButton(repr(device))] for device in devices]
-            buttons.append([KeyboardButton(_CANCEL_BUTTON)])
-            markup = ReplyKeyboardMarkup(buttons, one_time_keyboard=True)
-            await message.reply("Select a device", reply_markup=markup)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._config.device_request_timeout
+        finders = [
+            asyncio.create_task(self._find_each(finder, on_found))
+            for finder in self._finders.get_finders(self._config)
+        ]
 
-        else:
-            await message.reply("Supported devices not found in the network", reply_markup=_REMOVE_KEYBOARD)
+        selection: typing.Optional[Message] = None
+        shown = 0
+        last_edit = 0.
+
+        try:
+            # give the static finders (vlc, xbmc, web) a chance to be in the first keyboard
+            if finders:
+                await asyncio.wait(finders, timeout=_FIRST_RESULTS_WAIT)
+
+            while self._state_machine.get_state(message)[1] is data:
+                if len(data.devices) > shown:
+                    found.clear()
+                    shown = len(data.devices)
+                    markup = self._build_select_markup(data)
+
+                    if selection is None:
+                        selection = await message.reply("Select a device", reply_markup=markup)
+                    else:
+                        await selection.edit_reply_markup(markup)
+
+                    last_edit = loop.time()
+
+                pending = [finder for finder in finders if not finder.done()]
+                remains = deadline - loop.time()
+
+                if not pending or remains <= 0:
+                    break
+
+                waiter = asyncio.ensure_future(found.wait())
+
+                try:
+                    await asyncio.wait([waiter, *pending], timeout=remains, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+
+                # coalesce bursts of ssdp and mdns replies into a single message edit
+                throttle = min(last_edit + _KEYBOARD_EDIT_INTERVAL, deadline) - loop.time()
+
+                if found.is_set() and throttle > 0:
+                    await asyncio.sleep(throttle)
+
+        finally:
+            for finder in finders:
+                finder.cancel()
+
+            await asyncio.gather(*finders, return_exceptions=True)
+
+        if self._state_machine.get_state(message)[1] is data and not data.devices:
+            self._state_machine.set_state(message, States.NOTHING, False)
+            await message.reply("Supported devices not found in the network")
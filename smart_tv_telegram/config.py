@@ -3,21 +3,308 @@ import configparser
 import typing
 
 __all__ = [
-    "Config"
+    "Config",
+    "GovernorConfig",
+    "HelpersConfig",
+    "CacheConfig",
+    "DownloadConfig",
+    "ReadAheadConfig",
+    "WorkersConfig",
+    "HttpConfig",
+    "DiscoveryConfig"
 ]
 
 
+class GovernorConfig:
+    _enabled: bool
+    _min_rate: float
+    _max_rate: float
+    _burst: float
+    _latency_target: float
+
+    def __init__(self, section: configparser.SectionProxy):
+        self._enabled = bool(int(section.get("governor_enabled", "0")))
+        self._min_rate = float(section.get("governor_min_rate", "1"))
+        self._max_rate = float(section.get("governor_max_rate", "50"))
+        self._burst = float(section.get("governor_burst", "10"))
+        self._latency_target = float(section.get("governor_latency_target", "2"))
+
+        if not 0 < self._min_rate <= self._max_rate:
+            raise ValueError("governor rates should be 0 < governor_min_rate <= governor_max_rate")
+
+        if self._burst < 1:
+            raise ValueError("governor_burst should >= 1")
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def min_rate(self) -> float:
+        return self._min_rate
+
+    @property
+    def max_rate(self) -> float:
+        return self._max_rate
+
+    @property
+    def burst(self) -> float:
+        return self._burst
+
+    @property
+    def latency_target(self) -> float:
+        return self._latency_target
+
+
+class HelpersConfig:
+    _tokens: typing.List[str]
+    _relay_chat: int = 0
+
+    def __init__(self, section: configparser.SectionProxy):
+        self._tokens = ast.literal_eval(section.get("helper_tokens", "[]"))
+
+        if not isinstance(self._tokens, list):
+            raise ValueError("helper_tokens should be a list")
+
+        if not all(isinstance(x, str) for x in self._tokens):
+            raise ValueError("helper_tokens list should contain only strings")
+
+        if self._tokens:
+            self._relay_chat = int(section["helper_relay_chat"])
+
+            if not str(self._relay_chat).startswith("-100"):
+                raise ValueError("helper_relay_chat should be a channel or supergroup id (-100...)")
+
+    @property
+    def tokens(self) -> typing.List[str]:
+        return self._tokens
+
+    @property
+    def relay_chat(self) -> int:
+        return self._relay_chat
+
+
+class CacheConfig:
+    _memory_max_size: int
+    _disk_enabled: bool
+    _disk_path: str = ""
+    _disk_max_size: int = 0
+
+    def __init__(self, section: configparser.SectionProxy, block_size: int):
+        self._memory_max_size = int(section.get("memory_max_size", "8388608"))
+        self._disk_enabled = bool(int(section.get("disk_enabled", "0")))
+
+        if self._disk_enabled:
+            self._disk_path = str(section["disk_path"])
+            self._disk_max_size = int(section["disk_max_size"])
+
+            if self._disk_max_size < block_size:
+                raise ValueError("disk_max_size should >= block_size")
+
+    @property
+    def memory_max_size(self) -> int:
+        return self._memory_max_size
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self._disk_enabled
+
+    @property
+    def disk_path(self) -> str:
+        return self._disk_path
+
+    @property
+    def disk_max_size(self) -> int:
+        return self._disk_max_size
+
+
+class DownloadConfig:
+    _media_sessions_per_dc: int
+    _warmup_dcs: typing.List[int]
+    _message_cache_ttl: float
+    _message_cache_size: int
+    _governor: GovernorConfig
+    _helpers: HelpersConfig
+    _cache: CacheConfig
+
+    def __init__(self, section: configparser.SectionProxy, cache: CacheConfig):
+        self._media_sessions_per_dc = int(section.get("media_sessions_per_dc", "1"))
+
+        if self._media_sessions_per_dc < 1:
+            raise ValueError("media_sessions_per_dc should >= 1")
+
+        self._warmup_dcs = ast.literal_eval(section.get("warmup_dcs", "[]"))
+
+        if not isinstance(self._warmup_dcs, list):
+            raise ValueError("warmup_dcs should be a list")
+
+        if not all(isinstance(x, int) for x in self._warmup_dcs):
+            raise ValueError("warmup_dcs list should contain only integers")
+
+        self._message_cache_ttl = float(section.get("message_cache_ttl", "3600"))
+        self._message_cache_size = int(section.get("message_cache_size", "1024"))
+
+        if self._message_cache_size < 1:
+            raise ValueError("message_cache_size should >= 1")
+
+        self._governor = GovernorConfig(section)
+        self._helpers = HelpersConfig(section)
+        self._cache = cache
+
+    @property
+    def media_sessions_per_dc(self) -> int:
+        return self._media_sessions_per_dc
+
+    @property
+    def warmup_dcs(self) -> typing.List[int]:
+        return self._warmup_dcs
+
+    @property
+    def message_cache_ttl(self) -> float:
+        return self._message_cache_ttl
+
+    @property
+    def message_cache_size(self) -> int:
+        return self._message_cache_size
+
+    @property
+    def governor(self) -> GovernorConfig:
+        return self._governor
+
+    @property
+    def helpers(self) -> HelpersConfig:
+        return self._helpers
+
+    @property
+    def cache(self) -> CacheConfig:
+        return self._cache
+
+
+class ReadAheadConfig:
+    _first_window_size: int
+    _depth: int
+    _max_memory: int
+
+    def __init__(self, section: configparser.SectionProxy, block_size: int):
+        self._first_window_size = int(section.get("first_window_size", "65536"))
+        self._depth = int(section.get("read_ahead_depth", "1"))
+
+        if self._first_window_size < 4096 or self._first_window_size & (self._first_window_size - 1):
+            raise ValueError("first_window_size should be a power of two >= 4096")
+
+        if self._first_window_size > block_size:
+            raise ValueError("first_window_size should <= block_size")
+
+        self._max_memory = int(section.get("read_ahead_max_memory", str(block_size)))
+
+        if self._depth < 1:
+            raise ValueError("read_ahead_depth should >= 1")
+
+        if self._max_memory < block_size:
+            raise ValueError("read_ahead_max_memory should >= block_size")
+
+    @property
+    def first_window_size(self) -> int:
+        return self._first_window_size
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def max_memory(self) -> int:
+        return self._max_memory
+
+
+class WorkersConfig:
+    _processes: int
+    _port: int = 0
+    _shared_blocks: int = 0
+
+    def __init__(self, section: configparser.SectionProxy, listen_port: int):
+        self._processes = int(section.get("workers", "0"))
+
+        if self._processes < 0:
+            raise ValueError("workers should >= 0")
+
+        if self._processes:
+            self._port = int(section.get("workers_port", str(listen_port + 1)))
+            self._shared_blocks = int(section.get("workers_shared_blocks", "32"))
+
+            if self._port == listen_port:
+                raise ValueError("workers_port should != listen_port")
+
+            if self._shared_blocks < 1:
+                raise ValueError("workers_shared_blocks should >= 1")
+
+    @property
+    def processes(self) -> int:
+        return self._processes
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def shared_blocks(self) -> int:
+        return self._shared_blocks
+
+
+class HttpConfig:
+    _send_buffer_size: int
+    _workers: WorkersConfig
+    _stream_port: int
+
+    def __init__(self, section: configparser.SectionProxy, listen_port: int):
+        self._send_buffer_size = int(section.get("send_buffer_size", "262144"))
+
+        if self._send_buffer_size < 65536:
+            raise ValueError("send_buffer_size should >= 65536")
+
+        self._workers = WorkersConfig(section, listen_port)
+        self._stream_port = self._workers.port if self._workers.processes else listen_port
+
+    @property
+    def send_buffer_size(self) -> int:
+        return self._send_buffer_size
+
+    @property
+    def workers(self) -> WorkersConfig:
+        return self._workers
+
+    @property
+    def stream_port(self) -> int:
+        return self._stream_port
+
+
+class DiscoveryConfig:
+    _refresh_interval: int
+
+    def __init__(self, section: configparser.SectionProxy):
+        self._refresh_interval = int(section.get("refresh_interval", "300"))
+
+        if self._refresh_interval < 1:
+            raise ValueError("refresh_interval should >= 1")
+
+    @property
+    def refresh_interval(self) -> int:
+        return self._refresh_interval
+
+
 class Config:
     _api_id: int
     _api_hash: str
     _token: str
     _session_name: str
     _file_fake_fw_wait: float
+    _download: DownloadConfig
 
     _device_request_timeout: int
+    _discovery: DiscoveryConfig
 
     _listen_host: str
     _listen_port: int
+    _http: HttpConfig
 
     _upnp_enabled: bool
     _upnp_scan_timeout: int = 0
@@ -38,11 +325,15 @@ class Config:
 
     _admins: typing.List[int]
     _block_size: int
+    _read_ahead: ReadAheadConfig
 
     def __init__(self, path: str):
         config = configparser.ConfigParser()
         config.read(path)
 
+        if not config.has_section("cache"):  # optional section, older configs do not have it
+            config.add_section("cache")
+
         self._api_id = int(config["mtproto"]["api_id"])
         self._api_hash = str(config["mtproto"]["api_hash"])
         self._token = str(config["mtproto"]["token"])
@@ -51,9 +342,11 @@ class Config:
 
         self._listen_port = int(config["http"]["listen_port"])
         self._listen_host = str(config["http"]["listen_host"])
+        self._http = HttpConfig(config["http"], self._listen_port)
 
         self._request_gone_timeout = int(config["bot"]["request_gone_timeout"])
         self._device_request_timeout = int(config["discovery"]["device_request_timeout"])
+        self._discovery = DiscoveryConfig(config["discovery"])
 
         self._upnp_enabled = bool(int(config["discovery"]["upnp_enabled"]))
 
@@ -106,6 +399,8 @@ class Config:
 
         self._admins = ast.literal_eval(config["bot"]["admins"])
         self._block_size = int(config["bot"]["block_size"])
+        self._read_ahead = ReadAheadConfig(config["bot"], self._block_size)
+        self._download = DownloadConfig(config["mtproto"], CacheConfig(config["cache"], self._block_size))
 
         if not isinstance(self._admins, list):
             raise ValueError("admins should be a list")
@@ -129,6 +424,10 @@ class Config:
     def file_fake_fw_wait(self) -> float:
         return self._file_fake_fw_wait
 
+    @property
+    def download(self) -> DownloadConfig:
+        return self._download
+
     @property
     def api_id(self) -> int:
         return self._api_id
@@ -153,6 +452,10 @@ class Config:
     def listen_port(self) -> int:
         return self._listen_port
 
+    @property
+    def http(self) -> HttpConfig:
+        return self._http
+
     @property
     def upnp_enabled(self) -> bool:
         return self._upnp_enabled
@@ -196,3 +499,11 @@ class Config:
     @property
     def device_request_timeout(self) -> int:
         return self._device_request_timeout
+
+    @property
+    def discovery(self) -> DiscoveryConfig:
+        return self._discovery
+
+    @property
+    def read_ahead(self) -> ReadAheadConfig:
+        return self._read_ahead
@@ -1,4 +1,4 @@
-from .device import Device, DeviceFinder, RoutersDefType, RequestHandler, DevicePlayerFunction
+from .device import Device, DeviceFinder, RoutersDefType, RequestHandler, DevicePlayerFunction, OnDeviceFoundType
 from .upnp_device import UpnpDevice, UpnpDeviceFinder
 from .chromecast_device import ChromecastDevice, ChromecastDeviceFinder
 from .vlc_device import VlcDeviceFinder, VlcDevice
@@ -17,6 +17,7 @@ __all__ = [
     "VlcDevice",
     "VlcDeviceFinder",
     "RoutersDefType",
+    "OnDeviceFoundType",
     "RequestHandler",
     "WebDeviceFinder",
     "WebDevice",
@@ -1,6 +1,16 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import mimetypes
 import typing
+import uuid
 
-import catt.api
+import pychromecast
+import zeroconf
+from pychromecast.controllers.media import STREAM_TYPE_BUFFERED
+from pychromecast.discovery import CastBrowser, SimpleCastListener
+from pychromecast.models import CastInfo
 
 from . import Device, DeviceFinder, RoutersDefType, DevicePlayerFunction
 from .. import Config
@@ -11,78 +21,185 @@ __all__ = [
     "ChromecastDeviceFinder"
 ]
 
+_DEFAULT_CONTENT_TYPE = "video/mp4"
+_MEDIA_LOAD_TIMEOUT = 10
+
+
+class ChromecastConnection:
+    cast: pychromecast.Chromecast
+    _executor: concurrent.futures.ThreadPoolExecutor
+
+    def __init__(self, cast: pychromecast.Chromecast):
+        self.cast = cast
+        # one worker per device keeps its commands ordered without queueing behind other devices
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cast-{cast.uuid}")
+
+    async def dispatch(self, func, *args, **kwargs):
+        partial_function = functools.partial(func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial_function)
+
+    async def play_media(self, url: str, title: str):
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+
+        def on_response(msg_sent: bool, _: typing.Optional[dict]):
+            if not result.done():
+                result.set_result(msg_sent)
+
+        content_type = mimetypes.guess_type(title)[0] or _DEFAULT_CONTENT_TYPE
+
+        # play_media only queues the LOAD message, the device answer comes back on the socket thread
+        await self.dispatch(
+            self.cast.media_controller.play_media,
+            url,
+            content_type,
+            title=title,
+            stream_type=STREAM_TYPE_BUFFERED,
+            callback_function=functools.partial(loop.call_soon_threadsafe, on_response)
+        )
+
+        try:
+            # wait_for cancels the future on timeout, a late answer from the socket thread is then dropped
+            msg_sent = await asyncio.wait_for(result, _MEDIA_LOAD_TIMEOUT)
+        except asyncio.TimeoutError as error:
+            raise ConnectionError(f"chromecast {self.cast.name} did not answer the media load") from error
+
+        if not msg_sent:
+            raise ConnectionError(f"chromecast {self.cast.name} rejected the media")
+
+    def close(self):
+        self.cast.disconnect()
+        self._executor.shutdown(wait=False)
+
 
 class ChromecastPlayFunction(DevicePlayerFunction):
-    _device: catt.api.CattDevice
+    _connection: ChromecastConnection
 
-    def __init__(self, device: catt.api.CattDevice):
-        self._device = device
+    def __init__(self, connection: ChromecastConnection):
+        self._connection = connection
 
     async def get_name(self) -> str:
         return "PLAY"
 
     async def handle(self):
-        await run_method_in_executor(self._device.play)
+        await self._connection.dispatch(self._connection.cast.media_controller.play)
 
     async def is_enabled(self, config: Config):
         return True
 
 
 class ChromecastPauseFunction(DevicePlayerFunction):
-    _device: catt.api.CattDevice
+    _connection: ChromecastConnection
 
-    def __init__(self, device: catt.api.CattDevice):
-        self._device = device
+    def __init__(self, connection: ChromecastConnection):
+        self._connection = connection
 
     async def get_name(self) -> str:
         return "PAUSE"
 
     async def handle(self):
-        await run_method_in_executor(self._device.pause)
+        await self._connection.dispatch(self._connection.cast.media_controller.pause)
 
     async def is_enabled(self, config: Config):
         return True
 
 
 class ChromecastDevice(Device):
-    _device: catt.api.CattDevice
+    _connection: ChromecastConnection
 
-    def __init__(self, device: catt.api.CattDevice):
-        self._device = device
+    def __init__(self, connection: ChromecastConnection):
+        self._connection = connection
 
     def get_device_name(self) -> str:
-        return self._device.name
+        return self._connection.cast.name
 
     async def stop(self):
         pass
 
     async def on_close(self, local_token: int):
-        await run_method_in_executor(self._device.stop)
+        await self._connection.dispatch(self._connection.cast.quit_app)
 
     async def play(self, url: str, title: str, local_token: int):
-        await run_method_in_executor(self._device.play_url, url, title=title)
+        await self._connection.play_media(url, title)
 
     def get_player_functions(self) -> typing.List[DevicePlayerFunction]:
         return [
-            ChromecastPlayFunction(self._device),
-            ChromecastPauseFunction(self._device)
+            ChromecastPlayFunction(self._connection),
+            ChromecastPauseFunction(self._connection)
         ]
 
 
 class ChromecastDeviceFinder(DeviceFinder):
-    _devices_cache: typing.Dict[str, catt.api.CattDevice]
+    _browser: typing.Optional[CastBrowser]
+    _connections: typing.Dict[uuid.UUID, ChromecastConnection]
+    _connecting: typing.Set[uuid.UUID]
+    _loop: typing.Optional[asyncio.AbstractEventLoop]
+    _started: typing.Optional[asyncio.Future]
 
     def __init__(self):
-        self._devices_cache = {}
+        self._browser = None
+        self._connections = {}
+        self._connecting = set()
+        self._loop = None
+        self._started = None
+
+    async def start(self, config: Config):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+
+        await self._started
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+
+        # the browser callbacks run on the zeroconf threads, they are moved back to the event loop
+        listener = SimpleCastListener(
+            add_callback=lambda cast_uuid, _: self._loop.call_soon_threadsafe(self._on_cast_seen, cast_uuid),
+            update_callback=lambda cast_uuid, _: self._loop.call_soon_threadsafe(self._on_cast_seen, cast_uuid),
+            remove_callback=lambda cast_uuid, *_: self._loop.call_soon_threadsafe(self._on_cast_removed, cast_uuid)
+        )
+
+        # zeroconf must be created outside of the event loop thread, otherwise it borrows the running loop
+        instance = await run_method_in_executor(zeroconf.Zeroconf)
+        self._browser = CastBrowser(listener, instance)
+        await run_method_in_executor(self._browser.start_discovery)
+
+    def _on_cast_seen(self, cast_uuid: uuid.UUID):
+        if cast_uuid in self._connections:
+            return
+
+        cast_info: typing.Optional[CastInfo] = self._browser.devices.get(cast_uuid)
+
+        if cast_info is not None and cast_uuid not in self._connecting:
+            self._connecting.add(cast_uuid)
+            asyncio.ensure_future(self._connect(cast_uuid, cast_info))
+
+    async def _connect(self, cast_uuid: uuid.UUID, cast_info: CastInfo):
+        # noinspection PyBroadException
+        try:
+            cast = await run_method_in_executor(pychromecast.get_chromecast_from_cast_info, cast_info, self._browser.zc)
+            # the socket client thread keeps the connection open and reconnects on its own
+            cast.start()
+        except Exception:
+            logging.exception("unable to connect to chromecast %s", cast_info.friendly_name)
+        else:
+            self._connections[cast_uuid] = ChromecastConnection(cast)
+        finally:
+            self._connecting.discard(cast_uuid)
+
+    def _on_cast_removed(self, cast_uuid: uuid.UUID):
+        connection = self._connections.pop(cast_uuid, None)
+
+        if connection is not None:
+            asyncio.ensure_future(run_method_in_executor(connection.close))
 
     async def find(self, config: Config) -> typing.List[Device]:
-        found_devices: typing.List[catt.api.CattDevice] = await run_method_in_executor(catt.api.discover)
-        cached_devices: typing.List[catt.api.CattDevice] = []
-
-        for found_device in found_devices:
-            cached_devices.append(self._devices_cache.setdefault(found_device.ip_addr, found_device))
+        if self._started is None:
+            # not started from async_main, browse on demand the first time
+            await self.start(config)
+            await asyncio.sleep(config.chromecast_scan_timeout)
 
-        return [ChromecastDevice(device) for device in cached_devices]
+        return [ChromecastDevice(connection) for connection in self._connections.values()]
 
     @staticmethod
     def is_enabled(config: Config) -> bool:
@@ -22,11 +22,13 @@ class RequestHandler(abc.ABC):
 
 
 RoutersDefType = typing.List[RequestHandler]
+OnDeviceFoundType = typing.Callable[["Device"], None]
 
 __all__ = [
     "Device",
     "DeviceFinder",
     "RoutersDefType",
+    "OnDeviceFoundType",
     "RequestHandler",
     "DevicePlayerFunction"
 ]
@@ -76,6 +78,16 @@ class DeviceFinder(abc.ABC):
     async def find(self, config: Config) -> typing.List[Device]:
         raise NotImplementedError
 
+    async def find_each(self, config: Config, on_found: OnDeviceFoundType):
+        for device in await self.find(config):
+            on_found(device)
+
+    async def start(self, config: Config):
+        pass
+
+    async def stop(self, config: Config):
+        pass
+
     @staticmethod
     @abc.abstractmethod
     def is_enabled(config: Config) -> bool:
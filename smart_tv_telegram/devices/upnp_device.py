@@ -1,23 +1,32 @@
 import asyncio
+import datetime
 import enum
+import functools
 import html
 import io
+import logging
+import re
+import time
 import typing
+import urllib.parse
 import xml.etree
 import xml.etree.ElementTree
 from xml.sax.saxutils import escape
 
+import aiohttp
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
-from async_upnp_client.aiohttp import AiohttpRequester
+from async_upnp_client.aiohttp import AiohttpSessionRequester
 from async_upnp_client.client import UpnpService, UpnpDevice as UpnpServiceDevice
 from async_upnp_client.client_factory import UpnpFactory
-from async_upnp_client.event_handler import UpnpEventHandler
-from async_upnp_client.exceptions import UpnpError
+from async_upnp_client.const import SsdpSource, HttpRequest, HttpResponse
+from async_upnp_client.exceptions import UpnpError, UpnpResponseError
 from async_upnp_client.search import async_search
+from async_upnp_client.ssdp_listener import SsdpListener, SsdpDevice
 
-from . import Device, DeviceFinder, RoutersDefType, DevicePlayerFunction, RequestHandler
+from . import Device, DeviceFinder, RoutersDefType, DevicePlayerFunction, RequestHandler, OnDeviceFoundType
 from .. import Config
+from ..block_cache import SingleFlight
 from ..tools import ascii_only, base_url
 
 __all__ = [
@@ -46,6 +55,21 @@ _DLL_METADATA = """
 """
 
 _STATUS_TAG = "{urn:schemas-upnp-org:metadata-1-0/AVT/}TransportStatus"
+_STATUS_NAME = b"TransportStatus"
+_STATUS_VALUE_REGEX = re.compile(rb"\s+val=(?:\"|'|&quot;|&apos;|&#34;|&#39;|&#x22;|&#x27;)(\w*)", re.IGNORECASE)
+_STATUS_TAG_OPENERS = (b"<", b";", b":")  # <TransportStatus, &lt;TransportStatus, <avt:TransportStatus
+
+_BOOTID_HEADER = "BOOTID.UPNP.ORG"
+_CONFIGID_HEADER = "CONFIGID.UPNP.ORG"
+_DESCRIPTION_TTL = 3600
+_DESCRIPTION_CACHE_SIZE = 256
+_REQUESTER_CONNECTIONS_PER_HOST = 4
+
+_TIMEOUT_PREFIX = "second-"
+_SUBSCRIPTION_TIMEOUT = 1800
+_SUBSCRIPTION_RENEW_MARGIN = 30
+_SUBSCRIPTION_RETRY = 10
+_RENEWAL_REJECTED = (400, 412)
 
 
 async def _upnp_safe_stop(service: UpnpService):
@@ -89,7 +113,7 @@ class UpnpPlayerStatus(enum.Enum):
     STOPPED = enum.auto()
 
 
-def _player_status(data: bytes) -> UpnpPlayerStatus:
+def _player_status_full(data: bytes) -> UpnpPlayerStatus:
     event: xml.etree.ElementTree.Element
     decoded = html.unescape(data.decode("utf8"))
 
@@ -119,6 +143,42 @@ def _player_status(data: bytes) -> UpnpPlayerStatus:
     return UpnpPlayerStatus.NOTHING
 
 
+def _player_status(data: bytes) -> UpnpPlayerStatus:
+    # the LastChange payload is escaped xml inside the propertyset, a byte scan finds the statuses
+    # without decoding, unescaping and parsing the whole document for every event
+    reach_ok = False
+    position = data.find(_STATUS_NAME)
+
+    while position != -1:
+        end = position + len(_STATUS_NAME)
+
+        if data[position - 1:position] not in _STATUS_TAG_OPENERS:
+            position = data.find(_STATUS_NAME, end)
+            continue
+
+        match = _STATUS_VALUE_REGEX.match(data, end)
+
+        if match is None:
+            return _player_status_full(data)
+
+        status = match.group(1)
+        position = data.find(_STATUS_NAME, match.end())
+
+        if status == b"OK":
+            reach_ok = True
+
+        if status == b"STOPPED":
+            return UpnpPlayerStatus.STOPPED
+
+        if status == b"ERROR_OCCURRED":
+            return UpnpPlayerStatus.ERROR
+
+    if reach_ok:
+        return UpnpPlayerStatus.PLAYING
+
+    return UpnpPlayerStatus.NOTHING
+
+
 class DeviceStatus:
     reconnect: UpnpReconnectFunction
     playing: bool
@@ -212,18 +272,35 @@ class UpnpPauseFunction(DevicePlayerFunction):
         return config.upnp_enabled
 
 
+def _subscription_timeout(headers: typing.Mapping[str, str]) -> int:
+    timeout = headers.get("timeout", "")
+
+    if timeout.lower().startswith(_TIMEOUT_PREFIX) and timeout[len(_TIMEOUT_PREFIX):].isdigit():
+        return int(timeout[len(_TIMEOUT_PREFIX):])
+
+    # "Second-infinite" or a missing header, renew at our own pace
+    return _SUBSCRIPTION_TIMEOUT
+
+
 class SubscribeTask:
+    _device: UpnpServiceDevice
     _service: UpnpService
+    _url: str
+    _renewal_quirks: typing.Set[str]
+    _sid: typing.Optional[str]
     _task: typing.Optional[asyncio.Task]
-    _event_handler: UpnpEventHandler
 
     def __init__(self,
                  device: UpnpServiceDevice,
                  service: UpnpService,
-                 url: str):
+                 url: str,
+                 renewal_quirks: typing.Set[str]):
+        self._device = device
         self._service = service
+        self._url = url
+        self._renewal_quirks = renewal_quirks
+        self._sid = None
         self._task = None
-        self._event_handler = UpnpEventHandler(url, device.requester)
 
     async def start(self):
         await self.close()
@@ -235,16 +312,97 @@ class SubscribeTask:
 
         if task is not None:
             task.cancel()
-            await self._event_handler.async_unsubscribe_all()
 
-    async def _loop(self):
-        await self._event_handler.async_subscribe(self._service)
+        sid = self._sid
+        self._sid = None
 
+        if sid is not None:
+            await self._unsubscribe(sid)
+
+    async def _request(self, headers: typing.Dict[str, str]) -> HttpResponse:
+        event_url = self._service.event_sub_url
+        headers["HOST"] = urllib.parse.urlparse(event_url).netloc
+        request = HttpRequest("SUBSCRIBE", event_url, headers, None)
+        response = await self._device.requester.async_http_request(request)
+
+        if response.status_code != 200:
+            raise UpnpResponseError(status=response.status_code, headers=response.headers)
+
+        return response
+
+    async def _subscribe(self) -> int:
+        response = await self._request({
+            "NT": "upnp:event",
+            "CALLBACK": f"<{self._url}>",
+            "TIMEOUT": f"Second-{_SUBSCRIPTION_TIMEOUT}"
+        })
+
+        if not response.headers.get("sid"):
+            raise UpnpResponseError(status=response.status_code, headers=response.headers)
+
+        self._sid = response.headers["sid"]
+        return _subscription_timeout(response.headers)
+
+    async def _renew(self) -> int:
+        response = await self._request({"SID": self._sid, "TIMEOUT": f"Second-{_SUBSCRIPTION_TIMEOUT}"})
+        self._sid = response.headers.get("sid") or self._sid
+        return _subscription_timeout(response.headers)
+
+    async def _resubscribe(self) -> int:
+        # subscribe before dropping the old sid, so there is no window without events
+        old_sid = self._sid
+        timeout = await self._subscribe()
+
+        if old_sid is not None:
+            await self._unsubscribe(old_sid)
+
+        return timeout
+
+    async def _unsubscribe(self, sid: str):
+        event_url = self._service.event_sub_url
+        headers = {"HOST": urllib.parse.urlparse(event_url).netloc, "SID": sid}
+
+        try:
+            await self._device.requester.async_http_request(HttpRequest("UNSUBSCRIBE", event_url, headers, None))
+        except (UpnpError, aiohttp.ClientError, asyncio.TimeoutError):
+            logging.debug("unable to unsubscribe %s from %s", sid, event_url)
+
+    async def _next_timeout(self) -> int:
+        udn = self._device.udn
+
+        if self._sid is None or udn in self._renewal_quirks:
+            return await self._resubscribe()
+
+        try:
+            return await self._renew()
+        except UpnpResponseError as error:
+            # samsung tvs answer 412 to a valid renewal, remember it and resubscribe from now on,
+            # anything else (5xx, timeouts) is retried by the loop
+            if error.status not in _RENEWAL_REJECTED:
+                raise
+
+            logging.info("upnp device %s rejected the subscription renewal, resubscribing instead", udn)
+            self._renewal_quirks.add(udn)
+
+        return await self._resubscribe()
+
+    async def _loop(self):
         while True:
-            await asyncio.sleep(10)
-            # async_resubscribe_all NOT WORK ON SAMSUNG TV
-            await self._event_handler.async_unsubscribe_all()
-            await self._event_handler.async_subscribe(self._service)
+            try:
+                timeout = await self._next_timeout()
+            except (UpnpError, aiohttp.ClientError, asyncio.TimeoutError):
+                logging.exception("unable to subscribe to upnp events of %s", self._device.friendly_name)
+                sid = self._sid
+                self._sid = None
+
+                # the renderer may still hold the old subscription, do not leave it sending to us twice
+                if sid is not None:
+                    await self._unsubscribe(sid)
+
+                await asyncio.sleep(_SUBSCRIPTION_RETRY)
+                continue
+
+            await asyncio.sleep(max(timeout - min(_SUBSCRIPTION_RENEW_MARGIN, timeout / 2), 1))
 
 
 class UpnpDevice(Device):
@@ -253,12 +411,18 @@ class UpnpDevice(Device):
     _config: Config
     _subscribe_task: typing.Optional[SubscribeTask]
     _notify_handler: UpnpNotifyServer
+    _renewal_quirks: typing.Set[str]
 
-    def __init__(self, device: UpnpServiceDevice, config: Config, notify_handler: UpnpNotifyServer):
+    def __init__(self,
+                 device: UpnpServiceDevice,
+                 config: Config,
+                 notify_handler: UpnpNotifyServer,
+                 renewal_quirks: typing.Set[str]):
         self._device = device
         self._service = self._device.service(_AVTRANSPORT_SCHEMA)
         self._config = config
         self._notify_handler = notify_handler
+        self._renewal_quirks = renewal_quirks
         self._subscribe_task = None
 
     def get_device_name(self) -> str:
@@ -284,7 +448,7 @@ class UpnpDevice(Device):
         self._notify_handler.add_device(device_status, local_token)
 
         url = f"{base_url(self._config)}/upnp/notify/{local_token}"
-        self._subscribe_task = SubscribeTask(self._device, self._service, url)
+        self._subscribe_task = SubscribeTask(self._device, self._service, url, self._renewal_quirks)
         await self._subscribe_task.start()
 
         play = self._service.action("Play")
@@ -297,26 +461,242 @@ class UpnpDevice(Device):
         ]
 
 
+class _CachedDescription:
+    __slots__ = ("location", "boot_id", "config_id", "fetched", "device")
+
+    location: str
+    boot_id: typing.Optional[str]
+    config_id: typing.Optional[str]
+    fetched: float
+    device: UpnpServiceDevice
+
+    def __init__(self,
+                 location: str,
+                 boot_id: typing.Optional[str],
+                 config_id: typing.Optional[str],
+                 device: UpnpServiceDevice):
+        self.location = location
+        self.boot_id = boot_id
+        self.config_id = config_id
+        self.fetched = time.monotonic()
+        self.device = device
+
+    def is_expired(self, now: float) -> bool:
+        return now - self.fetched >= _DESCRIPTION_TTL
+
+    def is_valid(self, location: str, boot_id: typing.Optional[str], config_id: typing.Optional[str]) -> bool:
+        return self.location == location \
+            and self.boot_id == boot_id \
+            and self.config_id == config_id \
+            and not self.is_expired(time.monotonic())
+
+
+class _DescriptionCache:
+    _session: typing.Optional[aiohttp.ClientSession]
+    _factory: typing.Optional[UpnpFactory]
+    _entries: typing.Dict[str, _CachedDescription]
+    _single_flight: SingleFlight
+
+    def __init__(self):
+        self._session = None
+        self._factory = None
+        self._entries = {}
+        self._single_flight = SingleFlight()
+
+    def _get_factory(self) -> UpnpFactory:
+        # one pooled session for descriptions, control actions and eventing, it needs a running loop
+        if self._factory is None:
+            connector = aiohttp.TCPConnector(limit_per_host=_REQUESTER_CONNECTIONS_PER_HOST)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._factory = UpnpFactory(AiohttpSessionRequester(self._session))
+
+        return self._factory
+
+    async def close(self):
+        session = self._session
+        self._session = self._factory = None
+        self._entries.clear()
+
+        if session is not None:
+            await session.close()
+
+    async def get(self,
+                  udn: typing.Optional[str],
+                  location: str,
+                  headers: typing.Mapping[str, typing.Any]) -> UpnpServiceDevice:
+        key = udn or location
+        boot_id = headers.get(_BOOTID_HEADER)
+        config_id = headers.get(_CONFIGID_HEADER)
+        cached = self._entries.get(key)
+
+        if cached is not None and cached.is_valid(location, boot_id, config_id):
+            return cached.device
+
+        load = functools.partial(self._load, key, location, boot_id, config_id)
+        return await self._single_flight.run((key, location, boot_id, config_id), load)
+
+    async def _load(self,
+                    key: str,
+                    location: str,
+                    boot_id: typing.Optional[str],
+                    config_id: typing.Optional[str]) -> UpnpServiceDevice:
+        device = await self._get_factory().async_create_device(location)
+        self._put(key, _CachedDescription(location, boot_id, config_id, device))
+        return device
+
+    def _put(self, key: str, entry: _CachedDescription):
+        # renderers that left without a byebye are never asked for again, prune on insert
+        now = time.monotonic()
+
+        for expired in [cached_key for cached_key, cached in self._entries.items() if cached.is_expired(now)]:
+            del self._entries[expired]
+
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+
+        while len(self._entries) > _DESCRIPTION_CACHE_SIZE:
+            del self._entries[next(iter(self._entries))]
+
+
+class _RegisteredDevice:
+    __slots__ = ("ssdp_device", "device")
+
+    ssdp_device: SsdpDevice
+    device: UpnpServiceDevice
+
+    def __init__(self, ssdp_device: SsdpDevice, device: UpnpServiceDevice):
+        self.ssdp_device = ssdp_device
+        self.device = device
+
+    def is_fresh(self) -> bool:
+        return self.ssdp_device.valid_to > datetime.datetime.now()
+
+
 class UpnpDeviceFinder(DeviceFinder):
     _notify_handler: UpnpNotifyServer
+    _renewal_quirks: typing.Set[str]
+    _listener: typing.Optional[SsdpListener]
+    _descriptions: _DescriptionCache
+    _registry: typing.Dict[str, _RegisteredDevice]
+    _waiters: typing.List[typing.Callable[[_RegisteredDevice], None]]
+    _refresh_task: typing.Optional[asyncio.Task]
 
     def __init__(self):
         self._notify_handler = UpnpNotifyServer()
+        self._renewal_quirks = set()
+        self._listener = None
+        self._descriptions = _DescriptionCache()
+        self._registry = {}
+        self._waiters = []
+        self._refresh_task = None
+
+    async def start(self, config: Config):
+        listener = SsdpListener(async_callback=self._on_ssdp, search_target=_AVTRANSPORT_SCHEMA)
+
+        try:
+            await listener.async_start()
+        except OSError:
+            # port 1900 already taken (another media server), every find searches actively instead
+            logging.exception("unable to listen for ssdp advertisements, falling back to active search")
+            return
+
+        self._listener = listener
+        self._refresh_task = asyncio.create_task(self._refresh_loop(config.discovery.refresh_interval))
+
+    async def stop(self, config: Config):
+        task = self._refresh_task
+        self._refresh_task = None
+
+        if task is not None:
+            task.cancel()
+
+        listener = self._listener
+        self._listener = None
+
+        if listener is not None:
+            await listener.async_stop()
+
+        await self._descriptions.close()
+
+    async def _refresh_loop(self, interval: int):
+        # passive NOTIFY listening does most of the work, the m-search only catches renderers that stay quiet
+        while True:
+            # noinspection PyBroadException
+            try:
+                await self._listener.async_search()
+            except Exception:
+                logging.exception("upnp m-search failed")
+
+            await asyncio.sleep(interval)
+
+    async def _on_ssdp(self, ssdp_device: SsdpDevice, device_type: str, source: SsdpSource):
+        udn = ssdp_device.udn
+
+        if source == SsdpSource.ADVERTISEMENT_BYEBYE:
+            self._registry.pop(udn, None)
+            return
+
+        # advertisements arrive once for every device and service type, one description is enough
+        if device_type != _AVTRANSPORT_SCHEMA:
+            return
+
+        headers = ssdp_device.combined_headers(device_type)
+
+        # noinspection PyBroadException
+        try:
+            device = await self._descriptions.get(udn, ssdp_device.location, headers)
+        except Exception:
+            logging.exception("unable to load upnp device description %s", ssdp_device.location)
+            return
+
+        registered = self._registry[udn] = _RegisteredDevice(ssdp_device, device)
+
+        for waiter in self._waiters:
+            waiter(registered)
+
+    def _to_device(self, config: Config, registered: _RegisteredDevice) -> UpnpDevice:
+        return UpnpDevice(registered.device, config, self._notify_handler, self._renewal_quirks)
 
     async def find(self, config: Config) -> typing.List[Device]:
         devices = []
-        requester = AiohttpRequester()
-        factory = UpnpFactory(requester)
+        await self.find_each(config, devices.append)
+        return devices
+
+    async def find_each(self, config: Config, on_found: OnDeviceFoundType):
+        if self._listener is None:
+            await self._search(config, on_found)
+            return
+
+        for udn, registered in list(self._registry.items()):
+            if registered.is_fresh():
+                on_found(self._to_device(config, registered))
+            else:
+                del self._registry[udn]
 
+        if self._registry:
+            return
+
+        # nothing known yet (just started, or every renderer expired), fall back to a live search
+        def waiter(found: _RegisteredDevice):
+            on_found(self._to_device(config, found))
+
+        self._waiters.append(waiter)
+
+        try:
+            await self._listener.async_search()
+            await asyncio.sleep(config.upnp_scan_timeout)
+        finally:
+            self._waiters.remove(waiter)
+
+    async def _search(self, config: Config, on_found: OnDeviceFoundType):
         async def on_response(data: typing.Mapping[str, typing.Any]) -> None:
-            devices.append(await factory.async_create_device(data.get("LOCATION")))
+            device = await self._descriptions.get(data.get("_udn"), data.get("LOCATION"), data)
+            on_found(UpnpDevice(device, config, self._notify_handler, self._renewal_quirks))
 
         await async_search(search_target=_AVTRANSPORT_SCHEMA,
                            timeout=config.upnp_scan_timeout,
                            async_callback=on_response)
 
-        return [UpnpDevice(device, config, self._notify_handler) for device in devices]
-
     @staticmethod
     def is_enabled(config: Config) -> bool:
         return config.upnp_enabled
@@ -1,6 +1,5 @@
 import asyncio
 import io
-import logging
 import typing
 
 from . import DeviceFinder, Device, RoutersDefType, DevicePlayerFunction
@@ -11,11 +10,11 @@ __all__ = [
     "VlcDeviceFinder"
 ]
 
-_LOGGER = logging.getLogger(__name__)
 _ENCODING = "utf8"
 _EOF = b"\n\r"
 _AUTH_MAGIC = b"\xff\xfb\x01"
 _AUTH_OK = b"\xff\xfc\x01\r\nWelcome"
+_PROMPT = b"> "
 
 
 class VlcDeviceParams:
@@ -43,62 +42,160 @@ class VlcDeviceParams:
         return self._password
 
 
-class VlcDevice(Device):
-    params: VlcDeviceParams
-
-    def __init__(self, device: VlcDeviceParams):
-        self._params = device
+class VlcConnection:
+    _params: VlcDeviceParams
+    _reader: typing.Optional[asyncio.StreamReader]
+    _writer: typing.Optional[asyncio.StreamWriter]
+    _lock: asyncio.Lock
 
-    def get_device_name(self) -> str:
-        return f"vlc @{self._params.host}"
+    def __init__(self, params: VlcDeviceParams):
+        self._params = params
+        self._reader = None
+        self._writer = None
+        # asyncio.Lock wakes its waiters in fifo order, it is the command queue
+        self._lock = asyncio.Lock()
 
-    async def _call(self, method: str, *args: str):
+    async def _connect(self):
         reader, writer = await asyncio.open_connection(self._params.host, self._params.port)
         headers = await reader.read(io.DEFAULT_BUFFER_SIZE)
 
         if headers.endswith(_AUTH_MAGIC):
-            if self._params.password:
-                writer.write(bytes(self._params.password, _ENCODING) + _EOF)
-                await writer.drain()
+            if not self._params.password:
+                writer.close()
+                raise ConnectionError(f"vlc {self._params.host}: need password")
+
+            writer.write(bytes(self._params.password, _ENCODING) + _EOF)
+            await writer.drain()
+
+            auth_result = await reader.readuntil(_PROMPT)
+
+            if not auth_result.startswith(_AUTH_OK):
+                writer.close()
+                raise ConnectionError(f"vlc {self._params.host}: {auth_result.decode(_ENCODING, 'ignore')}")
+
+        elif not headers.endswith(_PROMPT):
+            await reader.readuntil(_PROMPT)
+
+        self._reader, self._writer = reader, writer
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+
+        self._reader = self._writer = None
+
+    async def _write(self, commands: typing.Sequence[str]):
+        # vlc closed the cached connection (restart, idle client), the reader has already seen the eof
+        if self._writer is not None and (self._writer.is_closing() or self._reader.at_eof()):
+            self._disconnect()
+
+        if self._writer is None:
+            await self._connect()
+
+        # every command is written at once, vlc answers them in order, each answer ends with the prompt
+        self._writer.write(b"".join(command.encode(_ENCODING) + _EOF for command in commands))
+        await self._writer.drain()
+
+    async def _read(self, count: int) -> typing.List[str]:
+        responses = []
+
+        for _ in range(count):
+            response = await self._reader.readuntil(_PROMPT)
+            responses.append(response[:-len(_PROMPT)].decode(_ENCODING, "ignore").strip())
+
+        return responses
+
+    async def send(self, *commands: str) -> typing.List[str]:
+        async with self._lock:
+            try:
+                try:
+                    await self._write(commands)
+
+                except ConnectionError:
+                    # the connection died before the commands were out, they can go again on a fresh one
+                    self._disconnect()
+                    await self._write(commands)
+
+                # once written vlc may have run them, a lost answer is an error, not a reason to play twice
+                return await self._read(len(commands))
+
+            except BaseException:
+                # failed or cancelled mid command, unread prompts would answer the next command
+                self._disconnect()
+                raise
 
-                auth_result = await reader.read(io.DEFAULT_BUFFER_SIZE)
 
-                if not auth_result.startswith(_AUTH_OK):
-                    _LOGGER.error("receive: %s", auth_result.decode(_ENCODING, "ignore"))
-                    return writer.close()
+class VlcPlayerFunction(DevicePlayerFunction):
+    _connection: VlcConnection
+    _name: str
+    _command: str
 
-            else:
-                _LOGGER.error("vlc %s: need password", self._params.host)
-                return writer.close()
+    def __init__(self, connection: VlcConnection, name: str, command: str):
+        self._connection = connection
+        self._name = name
+        self._command = command
 
-        writer.write(
-            method.encode(_ENCODING) + b" " +
-            b" ".join(a.encode(_ENCODING) for a in args) + _EOF
-        )
+    async def get_name(self) -> str:
+        return self._name
 
-        await writer.drain()
-        return writer.close()
+    async def handle(self):
+        await self._connection.send(self._command)
+
+    async def is_enabled(self, config: Config):
+        return config.vlc_enabled
+
+
+class VlcDevice(Device):
+    _params: VlcDeviceParams
+    _connection: VlcConnection
+
+    def __init__(self, device: VlcDeviceParams, connection: VlcConnection):
+        self._params = device
+        self._connection = connection
+
+    def get_device_name(self) -> str:
+        return f"vlc @{self._params.host}"
 
     async def stop(self):
-        await self._call("stop")
+        await self._connection.send("stop")
 
     async def on_close(self, local_token: int):
         pass
 
     async def play(self, url: str, title: str, local_token: int):
-        await self._call("add", url)
-        await self._call("play")
+        await self._connection.send(f"add {url}", "play")
 
     def get_player_functions(self) -> typing.List[DevicePlayerFunction]:
-        return []
+        return [
+            VlcPlayerFunction(self._connection, "PLAY", "play"),
+            VlcPlayerFunction(self._connection, "PAUSE", "pause"),
+            VlcPlayerFunction(self._connection, "-30s", "seek -30"),
+            VlcPlayerFunction(self._connection, "+30s", "seek +30")
+        ]
 
 
 class VlcDeviceFinder(DeviceFinder):
+    _connections: typing.Dict[typing.Tuple[str, int], VlcConnection]
+
+    def __init__(self):
+        self._connections = {}
+
+    def _get_connection(self, params: VlcDeviceParams) -> VlcConnection:
+        key = (params.host, params.port)
+
+        if key not in self._connections:
+            self._connections[key] = VlcConnection(params)
+
+        return self._connections[key]
+
     async def find(self, config: Config) -> typing.List[Device]:
-        return [
-            VlcDevice(VlcDeviceParams(params))
-            for params in config.vlc_devices
-        ]
+        devices = []
+
+        for raw_params in config.vlc_devices:
+            params = VlcDeviceParams(raw_params)
+            devices.append(VlcDevice(params, self._get_connection(params)))
+
+        return devices
 
     @staticmethod
     def is_enabled(config: Config) -> bool:
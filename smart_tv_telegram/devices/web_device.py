@@ -1,8 +1,11 @@
+import json
 import time
 import typing
 
+from aiohttp import WSMsgType
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
+from aiohttp.web_ws import WebSocketResponse
 
 from smart_tv_telegram import Config
 from smart_tv_telegram.devices import DeviceFinder, RoutersDefType, Device, RequestHandler, DevicePlayerFunction
@@ -13,33 +16,79 @@ __all__ = [
     "WebDevice"
 ]
 
+# aiohttp pings the tab every interval and closes the socket when the pong does not come back
+_HEARTBEAT_INTERVAL = 15.
+_CLOSE_UNKNOWN_TOKEN = 4404
+
 
 class WebDevice(Device):
     _url_to_play: typing.Optional[str] = None
+    _title_to_play: str = ""
     _device_name: str
     _remote_token: int
     _devices: typing.Dict[int, 'WebDevice']
-    _manipulation_timestamp: float
+    _socket: typing.Optional[WebSocketResponse]
+    _disconnected_at: float
 
     def __init__(self, device_name: str, token: int, devices: typing.Dict[int, 'WebDevice']):
         self._device_name = device_name
         self._remote_token = token
         self._devices = devices
-        self._manipulation_timestamp = time.time()
+        self._socket = None
+        self._disconnected_at = time.time()
+
+    async def _push(self, message: typing.Dict[str, str]) -> bool:
+        socket = self._socket
+
+        if socket is None or socket.closed:
+            return False
+
+        try:
+            await socket.send_str(json.dumps(message))
+        except ConnectionError:
+            return False
+
+        return True
 
     async def stop(self):
         self._url_to_play = None
+        await self._push({"action": "stop"})
 
     async def on_close(self, local_token: int):
         self._devices.pop(self._remote_token, None)
 
+        if self._socket is not None:
+            await self._socket.close(code=_CLOSE_UNKNOWN_TOKEN)
+
     async def play(self, url: str, title: str, local_token: int):
+        # kept until delivered, a tab that is reconnecting gets it as soon as it is back
         self._url_to_play = url
+        self._title_to_play = title
+
+        if await self._push({"action": "play", "url": url, "title": title}):
+            self._url_to_play = None
+
+    async def attach(self, socket: WebSocketResponse):
+        previous = self._socket
+        self._socket = socket
+
+        if previous is not None and previous is not socket:
+            await previous.close()
+
+        if self._url_to_play is not None:
+            if await self._push({"action": "play", "url": self._url_to_play, "title": self._title_to_play}):
+                self._url_to_play = None
 
-    def manipulate_timestamp(self) -> float:
-        old = self._manipulation_timestamp
-        self._manipulation_timestamp = time.time()
-        return old
+    def detach(self, socket: WebSocketResponse):
+        if self._socket is socket:
+            self._socket = None
+            self._disconnected_at = time.time()
+
+    def is_alive(self, grace: float) -> bool:
+        if self._socket is not None and not self._socket.closed:
+            return True
+
+        return time.time() - self._disconnected_at < grace
 
     def get_token(self) -> int:
         return self._remote_token
@@ -47,11 +96,6 @@ class WebDevice(Device):
     def get_device_name(self) -> str:
         return self._device_name
 
-    def get_url_to_play(self) -> typing.Optional[str]:
-        tmp = self._url_to_play
-        self._url_to_play = None
-        return tmp
-
     def get_player_functions(self) -> typing.List[DevicePlayerFunction]:
         return []
 
@@ -81,7 +125,7 @@ class WebDeviceApiRequestRegisterDevice(RequestHandler):
         return Response(status=200, body=str(remote_token))
 
 
-class WebDeviceApiRequestPoll(RequestHandler):
+class WebDeviceApiRequestSocket(RequestHandler):
     _config: Config
     _devices: typing.Dict[int, WebDevice]
 
@@ -90,29 +134,37 @@ class WebDeviceApiRequestPoll(RequestHandler):
         self._config = config
 
     def get_path(self) -> str:
-        return "/web/api/poll/{remote_token}"
+        return "/web/api/ws/{remote_token}"
 
     def get_method(self) -> str:
         return "GET"
 
-    async def handle(self, request: Request) -> Response:
+    async def handle(self, request: Request) -> typing.Union[Response, WebSocketResponse]:
         try:
             remote_token = int(request.match_info["remote_token"])
         except ValueError:
             return Response(status=400)
 
-        try:
-            device = self._devices[remote_token]
-        except KeyError:
-            return Response(status=404)
+        socket = WebSocketResponse(heartbeat=_HEARTBEAT_INTERVAL)
+        await socket.prepare(request)
+        device = self._devices.get(remote_token)
+
+        if device is None:
+            # browsers do not expose the handshake status, the close code tells the tab to register again
+            await socket.close(code=_CLOSE_UNKNOWN_TOKEN)
+            return socket
 
-        device.manipulate_timestamp()
-        url_to_play = device.get_url_to_play()
+        await device.attach(socket)
 
-        if url_to_play is None:
-            return Response(status=302)
+        try:
+            async for message in socket:
+                if message.type == WSMsgType.ERROR:
+                    break
 
-        return Response(status=200, body=url_to_play)
+        finally:
+            device.detach(socket)
+
+        return socket
 
 
 class WebDeviceFinder(DeviceFinder):
@@ -122,11 +174,8 @@ class WebDeviceFinder(DeviceFinder):
         self._devices = {}
 
     async def find(self, config: Config) -> typing.List[Device]:
-        devices = list(self._devices.values())
-        min_timestamp = time.time() - config.device_request_timeout
-
-        for device in devices:
-            if device.manipulate_timestamp() < min_timestamp:
+        for device in list(self._devices.values()):
+            if not device.is_alive(config.device_request_timeout):
                 self._devices.pop(device.get_token(), None)
 
         return list(self._devices.values())
@@ -138,5 +187,5 @@ class WebDeviceFinder(DeviceFinder):
     async def get_routers(self, config: Config) -> RoutersDefType:
         return [
             WebDeviceApiRequestRegisterDevice(config, self._devices),
-            WebDeviceApiRequestPoll(config, self._devices)
+            WebDeviceApiRequestSocket(config, self._devices)
         ]
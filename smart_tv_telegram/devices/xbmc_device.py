@@ -16,8 +16,6 @@ __all__ = [
     "XbmcDeviceFinder"
 ]
 
-MethodCallArgType = typing.Union[str, int, bool]
-
 _LOGGER = logging.getLogger(__name__)
 
 _JSON_HEADERS = {"content-type": "application/json"}
@@ -28,6 +26,9 @@ _ATTR_METHOD = "method"
 _ATTR_PARAMS = "params"
 _ATTR_ID = "id"
 
+# audio, video and picture players
+_PLAYER_IDS = (0, 1, 2)
+
 
 class XbmcDeviceParams:
     _host: str
@@ -60,10 +61,10 @@ class XbmcDeviceParams:
         return self._password
 
 
-class XbmcDevice(Device):
+class XbmcClient:
     _auth: typing.Optional[aiohttp.BasicAuth]
     _http_url: str
-    _host: str
+    _session: typing.Optional[aiohttp.ClientSession]
 
     def __init__(self, device: XbmcDeviceParams):
         if device.username:
@@ -72,82 +73,125 @@ class XbmcDevice(Device):
             self._auth = None
 
         self._http_url = f"http://{device.host}:{device.port}/jsonrpc"
-        self._host = device.host
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # kept open for the whole process, the connection to kodi is reused between calls
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(auth=self._auth, headers=_JSON_HEADERS)
+
+        return self._session
+
+    async def batch(self,
+                    calls: typing.List[typing.Tuple[str, typing.Mapping[str, typing.Any]]],
+                    log_errors: bool = True) -> typing.List[typing.Any]:
+        requests = [
+            {
+                _ATTR_JSONRPC: _JSONRPC_VERSION,
+                _ATTR_METHOD: method,
+                _ATTR_ID: str(uuid.uuid4()),
+                _ATTR_PARAMS: args
+            }
+            for method, args in calls
+        ]
 
-    def get_device_name(self) -> str:
-        return f"xbmc @{self._host}"
+        results = [None] * len(requests)
 
-    async def on_close(self, local_token: int):
-        pass
+        try:
+            async with self._get_session().post(self._http_url, data=json.dumps(requests)) as response:
+                if response.status == 401:
+                    _LOGGER.error(
+                        "Error fetching Kodi data. HTTP %d Unauthorized. "
+                        "Password is incorrect.", response.status)
+                    return results
 
-    async def _call(self, method: str, **args: typing.Union[MethodCallArgType, typing.Mapping[str, MethodCallArgType]]):
-        data = {
-            _ATTR_JSONRPC: _JSONRPC_VERSION,
-            _ATTR_METHOD: method,
-            _ATTR_ID: str(uuid.uuid4()),
-            _ATTR_PARAMS: args
-        }
+                if response.status != 200:
+                    _LOGGER.error(
+                        "Error fetching Kodi data. HTTP %d", response.status)
+                    return results
 
-        response = None
-        session = aiohttp.ClientSession(auth=self._auth, headers=_JSON_HEADERS)
+                response_json = await response.json()
 
-        try:
-            response = await session.post(self._http_url, data=json.dumps(data))
+        except (aiohttp.ClientError,
+                asyncio.TimeoutError,
+                ConnectionRefusedError):
+            return results
 
-            if response.status == 401:
-                _LOGGER.error(
-                    "Error fetching Kodi data. HTTP %d Unauthorized. "
-                    "Password is incorrect.", response.status)
-                return None
+        if not isinstance(response_json, list):
+            response_json = [response_json]
 
-            if response.status != 200:
-                _LOGGER.error(
-                    "Error fetching Kodi data. HTTP %d", response.status)
-                return None
+        positions = {request[_ATTR_ID]: position for position, request in enumerate(requests)}
 
-            response_json = await response.json()
+        for item in response_json:
+            position = positions.get(item.get(_ATTR_ID))
 
-            if "error" in response_json:
-                _LOGGER.error(
-                    "RPC Error Code %d: %s",
-                    response_json["error"]["code"],
-                    response_json["error"]["message"])
-                return None
+            if "error" in item:
+                if log_errors:
+                    _LOGGER.error(
+                        "RPC Error Code %d: %s",
+                        item["error"]["code"],
+                        item["error"]["message"])
 
-            return response_json["result"]
+            elif position is not None:
+                results[position] = item["result"]
 
-        except (aiohttp.ClientError,
-                asyncio.TimeoutError,
-                ConnectionRefusedError):
-            return None
+        return results
 
-        finally:
-            if response:
-                response.close()
 
-            await session.close()
+class XbmcDevice(Device):
+    _client: XbmcClient
+    _host: str
 
-    async def stop(self):
-        players = await self._call("Player.GetActivePlayers")
+    def __init__(self, device: XbmcDeviceParams, client: XbmcClient):
+        self._client = client
+        self._host = device.host
+
+    def get_device_name(self) -> str:
+        return f"xbmc @{self._host}"
+
+    async def on_close(self, local_token: int):
+        pass
 
-        if players:
-            await self._call("Player.Stop", playerid=players[0]["playerid"])
+    async def stop(self):
+        # stopping an idle player fails harmlessly, this saves the Player.GetActivePlayers round trip
+        await self._client.batch([
+            ("Player.Stop", {"playerid": player_id})
+            for player_id in _PLAYER_IDS
+        ], log_errors=False)
 
     async def play(self, url: str, title: str, local_token: int):
-        await self._call("Playlist.Clear", playlistid=0)
-        await self._call("Playlist.Add", playlistid=0, item={"file": url})
-        await self._call("Player.Open", item={"playlistid": 0}, options={"repeat": "one"})
+        await self._client.batch([
+            ("Playlist.Clear", {"playlistid": 0}),
+            ("Playlist.Add", {"playlistid": 0, "item": {"file": url}}),
+            ("Player.Open", {"item": {"playlistid": 0}, "options": {"repeat": "one"}})
+        ])
 
     def get_player_functions(self) -> typing.List[DevicePlayerFunction]:
         return []
 
 
 class XbmcDeviceFinder(DeviceFinder):
+    _clients: typing.Dict[typing.Tuple[str, int], XbmcClient]
+
+    def __init__(self):
+        self._clients = {}
+
+    def _get_client(self, params: XbmcDeviceParams) -> XbmcClient:
+        key = (params.host, params.port)
+
+        if key not in self._clients:
+            self._clients[key] = XbmcClient(params)
+
+        return self._clients[key]
+
     async def find(self, config: Config) -> typing.List[Device]:
-        return [
-            XbmcDevice(XbmcDeviceParams(params))
-            for params in config.xbmc_devices
-        ]
+        devices = []
+
+        for raw_params in config.xbmc_devices:
+            params = XbmcDeviceParams(raw_params)
+            devices.append(XbmcDevice(params, self._get_client(params)))
+
+        return devices
 
     @staticmethod
     def is_enabled(config: Config) -> bool:
@@ -1,3 +1,4 @@
+import asyncio
 import typing
 
 from smart_tv_telegram import Config
@@ -19,3 +20,9 @@ class DeviceFinderCollection:
 
     def get_finders(self, config: Config) -> typing.List[DeviceFinder]:
         return [finder for finder in self._finders if finder.is_enabled(config)]
+
+    async def start(self, config: Config):
+        await asyncio.gather(*(finder.start(config) for finder in self.get_finders(config)))
+
+    async def stop(self, config: Config):
+        await asyncio.gather(*(finder.stop(config) for finder in self.get_finders(config)))
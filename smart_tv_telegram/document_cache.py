@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import time
+import typing
+
+from pyrogram.raw.types import Message, MessageMediaDocument, Document
+from pyrogram.utils import get_peer_id
+
+from .tools import mtproto_filename
+
+__all__ = [
+    "DocumentMeta",
+    "DocumentCache",
+    "FetchMessagesType"
+]
+
+FetchMessagesType = typing.Callable[[typing.List[int]], typing.Awaitable[typing.List[typing.Any]]]
+
+
+class DocumentMeta:
+    __slots__ = ("message_id", "chat_id", "id", "access_hash", "file_reference", "dc_id", "size", "mime_type",
+                 "filename")
+
+    message_id: int
+    chat_id: int
+    id: int
+    access_hash: int
+    file_reference: bytes
+    dc_id: int
+    size: int
+    mime_type: str
+    filename: str
+
+    def __init__(self, message: Message):
+        if not isinstance(message.media, MessageMediaDocument):
+            raise ValueError("message without document")
+
+        document = message.media.document
+
+        if not isinstance(document, Document):
+            raise ValueError("message without document")
+
+        self.message_id = message.id
+        self.chat_id = get_peer_id(message.peer_id)
+        self.id = document.id
+        self.access_hash = document.access_hash
+        self.file_reference = document.file_reference
+        self.dc_id = document.dc_id
+        self.size = document.size
+        self.mime_type = document.mime_type
+
+        try:
+            self.filename = mtproto_filename(message)
+        except TypeError:
+            self.filename = f"file_{document.id}"
+
+
+class DocumentCache:
+    _fetch: FetchMessagesType
+    _ttl: float
+    _max_entries: int
+    _entries: typing.OrderedDict[int, typing.Tuple[float, DocumentMeta]]
+    _batch: typing.Dict[int, asyncio.Future]
+    _batch_task: typing.Optional[asyncio.Task]
+
+    def __init__(self, fetch: FetchMessagesType, ttl: float, max_entries: int):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._batch = {}
+        self._batch_task = None
+
+    def _put(self, meta: DocumentMeta):
+        self._entries[meta.message_id] = (time.monotonic() + self._ttl, meta)
+        self._entries.move_to_end(meta.message_id)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get_cached(self, message_id: int) -> typing.Optional[DocumentMeta]:
+        entry = self._entries.get(message_id)
+
+        if entry is None:
+            return None
+
+        expires, meta = entry
+
+        if expires < time.monotonic():
+            del self._entries[message_id]
+            return None
+
+        self._entries.move_to_end(message_id)
+        return meta
+
+    async def get(self, message_id: int) -> DocumentMeta:
+        meta = self.get_cached(message_id)
+
+        if meta is None:
+            meta = await self.load(message_id)
+
+        return meta
+
+    async def load(self, message_id: int) -> DocumentMeta:
+        future = self._batch.get(message_id)
+
+        if future is None:
+            future = self._batch[message_id] = asyncio.get_event_loop().create_future()
+
+        if self._batch_task is None:
+            self._batch_task = asyncio.get_event_loop().create_task(self._flush())
+
+        return await asyncio.shield(future)
+
+    async def _flush(self):
+        await asyncio.sleep(0)  # let every caller of the current loop iteration join the batch
+
+        batch = self._batch
+        self._batch = {}
+        self._batch_task = None
+
+        try:
+            messages = await self._fetch(list(batch.keys()))
+        except Exception as error:
+            for future in batch.values():
+                future.set_exception(error)
+                future.exception()
+
+            return
+
+        found = {message.id: message for message in messages if isinstance(message, Message)}
+
+        for message_id, future in batch.items():
+            message = found.get(message_id)
+
+            if message is None:
+                future.set_exception(ValueError("wrong message_id"))
+                future.exception()
+                continue
+
+            try:
+                meta = DocumentMeta(message)
+            except ValueError as error:
+                future.set_exception(error)
+                future.exception()
+                continue
+
+            self._put(meta)
+            future.set_result(meta)
@@ -0,0 +1,304 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import pickle
+import time
+import typing
+
+import pyrogram
+import pyrogram.session
+from pyrogram.errors import FloodWait, FileReferenceExpired
+from pyrogram.raw.functions.auth import ExportAuthorization, ImportAuthorization
+from pyrogram.raw.functions.channels import GetMessages as GetChannelMessages
+from pyrogram.raw.functions.upload import GetFile
+from pyrogram.raw.types import InputMessageID, InputDocumentFileLocation
+from pyrogram.raw.types.upload import File
+
+from . import Config
+from .block_cache import SingleFlight
+from .document_cache import DocumentMeta
+from .rate_governor import RateGovernor
+from .session_pool import MediaSessionPool
+
+__all__ = [
+    "DownloadAccount",
+    "HelperDownloadAccount",
+    "ResolveDocumentType",
+    "RelayDocumentType"
+]
+
+# (document seen by the main account, refresh) -> the same document as seen by this account
+ResolveDocumentType = typing.Callable[[DocumentMeta, bool], typing.Awaitable[DocumentMeta]]
+# document seen by the main account -> id of its copy in the relay chat
+RelayDocumentType = typing.Callable[[DocumentMeta], typing.Awaitable[int]]
+
+_FAILURE_BACKOFF = 5.
+_FAILURE_MAX_BACKOFF = 300.
+
+
+class DownloadAccount:
+    _name: str
+    _config: Config
+    _client: pyrogram.Client
+    _session_name: str
+    _resolve: ResolveDocumentType
+    _keys: typing.Dict[int, bytes]
+    _media_pools: typing.Dict[int, MediaSessionPool]
+    _media_pools_single_flight: SingleFlight
+    _governors: typing.Dict[int, RateGovernor]
+
+    _inflight: int
+    _requests: int
+    _downloaded: int
+    _errors: int
+    _flood_waits: int
+    _failures: int
+    _unhealthy_until: float
+
+    def __init__(self, name: str, config: Config, client: pyrogram.Client, session_name: str,
+                 resolve: ResolveDocumentType):
+        self._name = name
+        self._config = config
+        self._client = client
+        self._session_name = session_name
+        self._resolve = resolve
+        self._keys = {}
+        self._media_pools = {}
+        self._media_pools_single_flight = SingleFlight()
+        self._governors = {}
+
+        self._inflight = 0
+        self._requests = 0
+        self._downloaded = 0
+        self._errors = 0
+        self._flood_waits = 0
+        self._failures = 0
+        self._unhealthy_until = 0.
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def is_healthy(self, now: float) -> bool:
+        return self._unhealthy_until <= now
+
+    def is_connected(self) -> bool:
+        return all(x.is_connected() for x in self._media_pools.values())
+
+    def score(self, dc_id: int) -> typing.Tuple[float, int]:
+        governor = self._governors.get(dc_id)
+        backlog = governor.get_backlog() if governor is not None else 0.
+        return backlog, self._inflight
+
+    def _on_failure(self):
+        self._errors += 1
+        self._failures += 1
+        backoff = min(_FAILURE_MAX_BACKOFF, _FAILURE_BACKOFF * 2 ** (self._failures - 1))
+        self._unhealthy_until = time.monotonic() + backoff
+
+    def get_state(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "inflight": self._inflight,
+            "requests": self._requests,
+            "downloaded": self._downloaded,
+            "errors": self._errors,
+            "flood_waits": self._flood_waits,
+            "unhealthy_for": max(0., self._unhealthy_until - time.monotonic()),
+            "governors": self.get_governors_state()
+        }
+
+    def _get_governor(self, dc_id: int) -> RateGovernor:
+        governor = self._governors.get(dc_id)
+
+        if governor is None:
+            config = self._config.download.governor
+            governor = self._governors[dc_id] = RateGovernor(
+                config.min_rate,
+                config.max_rate,
+                config.burst,
+                config.latency_target
+            )
+
+        return governor
+
+    def get_governors_state(self) -> typing.Dict[int, typing.Dict[str, float]]:
+        return {dc_id: governor.get_state() for dc_id, governor in self._governors.items()}
+
+    async def get_file(self, document: DocumentMeta, offset: int, block_size: int) -> bytes:
+        self._inflight += 1
+        self._requests += 1
+
+        try:
+            block = await self._get_file(document, offset, block_size)
+
+        except Exception:
+            self._on_failure()
+            raise
+
+        else:
+            self._failures = 0
+            self._downloaded += len(block)
+            return block
+
+        finally:
+            self._inflight -= 1
+
+    async def _get_file(self, document: DocumentMeta, offset: int, block_size: int) -> bytes:
+        pool = await self._get_media_pool(document.dc_id)
+        enabled = self._config.download.governor.enabled
+        governor = self._get_governor(document.dc_id) if enabled else None
+        location = await self._resolve(document, False)
+        result: typing.Optional[File] = None
+        reference_refreshed = False
+
+        while not isinstance(result, File):
+            request = GetFile(
+                offset=offset,
+                limit=block_size,
+                location=InputDocumentFileLocation(
+                    id=location.id,
+                    access_hash=location.access_hash,
+                    file_reference=location.file_reference,
+                    thumb_size=""
+                )
+            )
+
+            if governor is not None:
+                await governor.acquire()
+
+            try:
+                # the governor judges the rpc itself, not the wait behind this stream's own read-ahead
+                result = await pool.invoke(request, governor.on_success if governor is not None else None)
+
+            except FloodWait as error:
+                self._flood_waits += 1
+
+                if governor is None:  # file floodwait is fake
+                    await asyncio.sleep(self._config.file_fake_fw_wait)
+                    continue
+
+                governor.on_flood_wait(max(float(error.value or 0), self._config.file_fake_fw_wait))
+                logging.log(logging.INFO, "%s dc %d floodwait, governor: %s", self._name, document.dc_id,
+                            governor.get_state())
+
+            except FileReferenceExpired:
+                if reference_refreshed:
+                    raise
+
+                location = await self._resolve(document, True)
+                reference_refreshed = True
+
+        return result.bytes
+
+    def _keys_path(self) -> str:
+        return self._session_name + ".keys"
+
+    def _save_keys(self):
+        # written aside and renamed, a crash mid write must not leave a truncated keys file behind
+        path = self._keys_path()
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as file:
+            pickle.dump(self._keys, file)
+
+        os.replace(tmp_path, path)
+
+    async def _get_media_pool(self, dc_id: int) -> MediaSessionPool:
+        pool = self._media_pools.get(dc_id)
+
+        if pool is None:
+            pool = await self._media_pools_single_flight.run(dc_id, functools.partial(self._start_media_pool, dc_id))
+
+        return pool
+
+    async def _start_media_pool(self, dc_id: int) -> MediaSessionPool:
+        session = functools.partial(pyrogram.session.Session, self._client, dc_id, is_media=True, test_mode=False)
+
+        if dc_id != await self._client.storage.dc_id():
+            if dc_id not in self._keys:
+                exported_auth = await self._client.invoke(ExportAuthorization(dc_id=dc_id))
+
+                auth = pyrogram.session.Auth(self._client, dc_id, False)
+                auth_key = await auth.create()
+
+                first_session = session(auth_key)
+                await first_session.start()
+
+                await first_session.invoke(ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
+                self._keys[dc_id] = first_session.auth_key
+                self._save_keys()
+
+            else:
+                first_session = session(self._keys[dc_id])
+                await first_session.start()
+
+        else:
+            first_session = session(await self._client.storage.auth_key())
+            await first_session.start()
+
+        sessions = [first_session]
+        sessions.extend(session(first_session.auth_key)
+                        for _ in range(self._config.download.media_sessions_per_dc - 1))
+        await asyncio.gather(*(x.start() for x in sessions[1:]))
+
+        pool = self._media_pools[dc_id] = MediaSessionPool(dc_id, sessions)
+        self._client.media_sessions[dc_id] = first_session
+
+        return pool
+
+    async def start(self):
+        await self._client.start()
+
+        if os.path.exists(self._keys_path()):
+            with open(self._keys_path(), "rb") as file:
+                self._keys = pickle.load(file)
+
+        await asyncio.gather(*(self._get_media_pool(dc_id) for dc_id in self._config.download.warmup_dcs))
+
+
+class HelperDownloadAccount(DownloadAccount):
+    _relay: RelayDocumentType
+    _documents: typing.OrderedDict[int, DocumentMeta]
+    _documents_single_flight: SingleFlight
+
+    def __init__(self, name: str, config: Config, token: str, relay: RelayDocumentType):
+        session_name = f"{config.session_name}_{name}"
+        client = pyrogram.Client(session_name, config.api_id, config.api_hash, bot_token=token, sleep_threshold=0,
+                                 workdir=os.getcwd(), no_updates=True)
+
+        super().__init__(name, config, client, session_name, self._resolve_relayed)
+        self._relay = relay
+        self._documents = collections.OrderedDict()
+        self._documents_single_flight = SingleFlight()
+
+    async def _resolve_relayed(self, document: DocumentMeta, refresh: bool) -> DocumentMeta:
+        # access_hash and file_reference are per account, this bot reads its own copy from the relay chat
+        relayed = None if refresh else self._documents.get(document.id)
+
+        if relayed is None:
+            relayed = await self._documents_single_flight.run(document.id, functools.partial(self._load, document))
+
+        # other documents loaded while this one waited may have evicted it already
+        if document.id in self._documents:
+            self._documents.move_to_end(document.id)
+
+        return relayed
+
+    async def _load(self, document: DocumentMeta) -> DocumentMeta:
+        relay_message_id = await self._relay(document)
+        channel = await self._client.resolve_peer(self._config.download.helpers.relay_chat)
+        request = GetChannelMessages(channel=channel, id=[InputMessageID(id=relay_message_id)])
+        messages = await self._client.invoke(request)
+        relayed = DocumentMeta(messages.messages[0])
+
+        if relayed.id != document.id:
+            raise ValueError("relayed document changed")
+
+        self._documents[document.id] = relayed
+
+        while len(self._documents) > self._config.download.message_cache_size:
+            self._documents.popitem(last=False)
+
+        return relayed
@@ -1,21 +1,25 @@
 import abc
 import asyncio
+import functools
 import os.path
+import traceback
 import typing
 from urllib.parse import quote
 
 from aiohttp import web
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response, StreamResponse
-from pyrogram.raw.types import MessageMediaDocument, Document
-from pyrogram.utils import get_peer_id
 
 from . import Config, Mtproto, DeviceFinderCollection
-from .tools import parse_http_range, mtproto_filename, serialize_token, AsyncDebounce
+from .document_cache import DocumentMeta
+from .read_ahead import ReadAhead, fetch_windows, FETCH_ALIGNMENT, FETCH_MAX_LIMIT
+from .stream_session import StreamSession, StreamSessionRegistry
+from .tools import parse_http_range, serialize_token
 
 __all__ = [
     "Http",
-    "OnStreamClosed"
+    "OnStreamClosed",
+    "StreamSessionObserver"
 ]
 
 
@@ -25,38 +29,76 @@ class OnStreamClosed(abc.ABC):
         raise NotImplementedError
 
 
+class StreamSessionObserver(abc.ABC):
+    @abc.abstractmethod
+    def on_session_added(self, session: StreamSession):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def on_session_removed(self, local_token: int):
+        raise NotImplementedError
+
+
+class _StreamRequest:
+    __slots__ = ("session", "document", "offset", "data_to_skip", "max_size")
+
+    session: StreamSession
+    document: DocumentMeta
+    offset: int
+    data_to_skip: int
+    max_size: int
+
+    def __init__(self, session: StreamSession, document: DocumentMeta, offset: int, data_to_skip: int, max_size: int):
+        self.session = session
+        self.document = document
+        self.offset = offset
+        self.data_to_skip = data_to_skip
+        self.max_size = max_size
+
+
 class Http:
     _mtproto: Mtproto
     _config: Config
     _finders: DeviceFinderCollection
     _on_stream_closed: typing.Optional[OnStreamClosed] = None
+    _session_observer: typing.Optional[StreamSessionObserver] = None
+    _read_ahead_depth: int
+    _max_window_size: int
 
-    _tokens: typing.Set[int]
-    _downloaded_blocks: typing.Dict[int, typing.Set[int]]
-    _stream_debounce: typing.Dict[int, AsyncDebounce]
-    _stream_transports: typing.Dict[int, typing.Set[asyncio.Transport]]
+    _sessions: StreamSessionRegistry
+    _connections: typing.Set[typing.Tuple[ReadAhead, typing.Optional[asyncio.Transport]]]
 
     def __init__(self, mtproto: Mtproto, config: Config, finders: DeviceFinderCollection):
         self._mtproto = mtproto
         self._config = config
         self._finders = finders
+        self._read_ahead_depth = max(1, min(config.read_ahead.depth, config.read_ahead.max_memory // config.block_size))
+        self._max_window_size = 1 << (min(config.block_size, FETCH_MAX_LIMIT).bit_length() - 1)
 
-        self._tokens = set()
-        self._downloaded_blocks = {}
-        self._stream_debounce = {}
-        self._stream_transports = {}
+        self._sessions = StreamSessionRegistry(self._timeout_handler, config.request_gone_timeout)
+        self._connections = set()
 
     def set_on_stream_closed_handler(self, handler: OnStreamClosed):
         self._on_stream_closed = handler
 
-    async def start(self):
-        app = web.Application()
-        app.router.add_static("/static/", os.path.dirname(__file__) + "/static/")
-        app.router.add_get("/stream/{message_id}/{token}", self._stream_handler)
+    def set_session_observer(self, observer: StreamSessionObserver):
+        self._session_observer = observer
+
+    def _add_stream_routes(self, app: web.Application):
+        app.router.add_get("/stream/{message_id}/{token}", self._stream_handler, allow_head=False)
+        app.router.add_head("/stream/{message_id}/{token}", self._stream_head_handler)
         app.router.add_options("/stream/{message_id}/{token}", self._upnp_discovery_handler)
         app.router.add_put("/stream/{message_id}/{token}", self._upnp_discovery_handler)
         app.router.add_get("/healthcheck", self._health_check_handler)
 
+    async def start(self):
+        self._sessions.start()
+
+        app = web.Application()
+        app.router.add_static("/static/", os.path.dirname(__file__) + "/static/")
+        self._add_stream_routes(app)
+        app.router.add_get("/stats", self._stats_handler)
+
         for finder in self._finders.get_finders(self._config):
             routers = await finder.get_routers(self._config)
 
@@ -66,25 +108,36 @@ class Http:
         # noinspection PyProtectedMember
         await web._run_app(app, host=self._config.listen_host, port=self._config.listen_port)
 
-    def add_remote_token(self, message_id: int, partial_remote_token: int) -> int:
+    def add_remote_token(self, message_id: int, partial_remote_token: int, chat_id: int) -> int:
         local_token = serialize_token(message_id, partial_remote_token)
-        self._tokens.add(local_token)
+        session = StreamSession(local_token, message_id, chat_id, self._config.block_size)
+        self._sessions.add(session)
+
+        if self._session_observer is not None:
+            self._session_observer.on_session_added(session)
+
         return local_token
 
-    def _check_local_token(self, local_token: int) -> bool:
-        return local_token in self._tokens
+    def remove_remote_token(self, local_token: int):
+        self._sessions.remove(local_token)
+
+        if self._session_observer is not None:
+            self._session_observer.on_session_removed(local_token)
+
+    def touch_session(self, session: StreamSession):
+        self._sessions.touch(session)
 
     @staticmethod
     def _write_http_range_headers(result: StreamResponse, read_after: int,  size: int, max_size: int):
-        result.headers.setdefault("Content-Range", f"bytes {read_after}-{max_size}/{size}")
+        result.headers.setdefault("Content-Range", f"bytes {read_after}-{max_size - 1}/{size}")
         result.headers.setdefault("Accept-Ranges", "bytes")
-        result.headers.setdefault("Content-Length", str(size))
+        result.headers.setdefault("Content-Length", str(max_size - read_after))
 
     @staticmethod
     def _write_access_control_headers(result: StreamResponse):
         result.headers.setdefault("Content-Type", "video/mp4")
         result.headers.setdefault("Access-Control-Allow-Origin", "*")
-        result.headers.setdefault("Access-Control-Allow-Methods", "GET, OPTIONS")
+        result.headers.setdefault("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
         result.headers.setdefault("Access-Control-Allow-Headers", "Content-Type")
         result.headers.setdefault("transferMode.dlna.org", "Streaming")
         result.headers.setdefault("TimeSeekRange.dlna.org", "npt=0.00-")
@@ -101,64 +154,48 @@ class Http:
         except ConnectionError:
             return Response(status=500, text="gone")
 
+    def _get_connections_memory(self) -> typing.Dict[str, int]:
+        buffered = [
+            read_ahead.buffered_bytes() + (transport.get_write_buffer_size() if transport is not None else 0)
+            for read_ahead, transport in self._connections
+        ]
+        send_buffer_size = self._config.http.send_buffer_size
+
+        return {
+            "connections": len(buffered),
+            "buffered_total": sum(buffered),
+            "buffered_max": max(buffered, default=0),
+            "bound_per_connection": self._read_ahead_depth * self._max_window_size + 2 * send_buffer_size
+        }
+
+    async def _stats_handler(self, _: Request) -> typing.Optional[Response]:
+        return web.json_response({
+            "streams": len(self._sessions),
+            "memory": self._get_connections_memory(),
+            "governors": self._mtproto.get_governors_state(),
+            "accounts": self._mtproto.get_accounts_state()
+        })
+
     async def _upnp_discovery_handler(self, _: Request) -> typing.Optional[Response]:
         result = Response(status=200)
         self._write_access_control_headers(result)
         return result
 
-    def _feed_timeout(self, message_id: int, chat_id: int, local_token: int, size: int):
-        debounce = self._stream_debounce.setdefault(
-            local_token,
-            AsyncDebounce(self._timeout_handler, self._config.request_gone_timeout)
-        )
-
-        debounce.update_args(message_id, chat_id, local_token, size)
-
-    def _feed_downloaded_blocks(self, block_id: int, local_token: int):
-        downloaded_blocks = self._downloaded_blocks.setdefault(local_token, set())
-        downloaded_blocks.add(block_id)
-
-    def _feed_stream_transport(self, local_token: int, transport: asyncio.Transport):
-        transports = self._stream_transports.setdefault(local_token, set())
-        transports.add(transport)
-
-    def _get_stream_transports(self, local_token: int) -> typing.Set[asyncio.Transport]:
-        return self._stream_transports[local_token] if local_token in self._stream_transports else set()
-
-    async def _timeout_handler(self, message_id: int, chat_id: int, local_token: int, size: int):
-        _debounce: typing.Optional[AsyncDebounce] = None  # avoid garbage collector
+    async def _timeout_handler(self, session: StreamSession):
+        if self._session_observer is not None:
+            self._session_observer.on_session_removed(session.local_token)
 
-        if all(t.is_closing() for t in self._get_stream_transports(local_token)):
-            blocks = (size // self._config.block_size) + 1
+        on_stream_closed = self._on_stream_closed
 
-            if local_token in self._tokens:
-                self._tokens.remove(local_token)
-
-            remain_blocks = blocks
-
-            if local_token in self._downloaded_blocks:
-                remain_blocks = blocks - len(self._downloaded_blocks[local_token])
-                del self._downloaded_blocks[local_token]
-
-            if local_token in self._stream_debounce:
-                _debounce = self._stream_debounce[local_token]
-                del self._stream_debounce[local_token]
-
-            if local_token in self._stream_transports:
-                del self._stream_transports[local_token]
-
-            remain_blocks_perceptual = remain_blocks / blocks * 100
-            on_stream_closed = self._on_stream_closed
-
-            if isinstance(on_stream_closed, OnStreamClosed):
-                await on_stream_closed.handle(remain_blocks_perceptual, chat_id, message_id, local_token)
-
-        if local_token in self._stream_debounce:
-            self._stream_debounce[local_token].reschedule()
-
-        del _debounce
+        if isinstance(on_stream_closed, OnStreamClosed):
+            # noinspection PyBroadException
+            try:
+                await on_stream_closed.handle(session.remains_percent(), session.chat_id, session.message_id,
+                                              session.local_token)
+            except Exception:
+                traceback.print_exc()
 
-    async def _stream_handler(self, request: Request) -> typing.Optional[Response]:
+    async def _parse_stream_request(self, request: Request) -> typing.Union[Response, _StreamRequest]:
         _message_id: str = request.match_info["message_id"]
 
         if not _message_id.isdigit():
@@ -174,9 +211,9 @@ class Http:
         message_id = int(_message_id)
         del _message_id
 
-        local_token = serialize_token(message_id, token)
+        session = self._sessions.get(serialize_token(message_id, token))
 
-        if not self._check_local_token(local_token):
+        if session is None:
             return Response(status=403)
 
         range_header = request.headers.get("Range")
@@ -188,7 +225,7 @@ class Http:
 
         else:
             try:
-                offset, data_to_skip, max_size = parse_http_range(range_header, self._config.block_size)
+                offset, data_to_skip, max_size = parse_http_range(range_header, FETCH_ALIGNMENT)
             except ValueError:
                 return Response(status=400)
 
@@ -196,66 +233,143 @@ class Http:
             return Response(status=500)
 
         try:
-            message = await self._mtproto.get_message(int(message_id))
+            document = await self._mtproto.get_document(message_id)
         except ValueError:
             return Response(status=404)
 
-        if not isinstance(message.media, MessageMediaDocument):
-            return Response(status=404)
-
-        if not isinstance(message.media.document, Document):
-            return Response(status=404)
-
-        size = message.media.document.size
+        size = document.size
         read_after = offset + data_to_skip
 
         if read_after > size:
             return Response(status=400)
 
-        if (max_size is not None) and (size < max_size):
-            return Response(status=400)
-
         if max_size is None:
             max_size = size
+        else:
+            # the range end is inclusive, max_size is the exclusive end of the response
+            max_size = min(max_size + 1, size)
+
+        if read_after >= max_size and size:
+            unsatisfiable = Response(status=416)
+            unsatisfiable.headers.setdefault("Content-Range", f"bytes */{size}")
+            unsatisfiable.headers.setdefault("Accept-Ranges", "bytes")
+            self._write_access_control_headers(unsatisfiable)
+            return unsatisfiable
+
+        session.set_size(size)
+        return _StreamRequest(session, document, offset, data_to_skip, max_size)
+
+    def _build_stream_response(self, stream_request: _StreamRequest) -> StreamResponse:
+        size = stream_request.document.size
+        read_after = stream_request.offset + stream_request.data_to_skip
+        max_size = stream_request.max_size
 
         stream = StreamResponse(status=206 if (read_after or (max_size != size)) else 200)
         self._write_http_range_headers(stream, read_after, size, max_size)
 
-        try:
-            filename = mtproto_filename(message)
-        except TypeError:
-            filename = f"file_{message.media.document.id}"
-
-        self._write_filename_header(stream, filename)
+        self._write_filename_header(stream, stream_request.document.filename)
         self._write_access_control_headers(stream)
 
+        return stream
+
+    async def _stream_head_handler(self, request: Request) -> typing.Optional[Response]:
+        stream_request = await self._parse_stream_request(request)
+
+        if isinstance(stream_request, Response):
+            return stream_request
+
+        stream = self._build_stream_response(stream_request)
         await stream.prepare(request)
+        await stream.write_eof()
 
-        while offset < max_size:
-            self._feed_timeout(message_id, get_peer_id(message.peer_id), local_token, size)
-            block = await self._mtproto.get_block(message, offset, self._config.block_size)
-            new_offset = offset + len(block)
+        return stream
 
-            if data_to_skip:
-                block = block[data_to_skip:]
-                data_to_skip = False
+    def _stream_opened(self, session: StreamSession, transport: typing.Optional[asyncio.Transport]):
+        if transport is not None:
+            session.transports.add(transport)
 
-            if new_offset > max_size:
-                block = block[:-(new_offset - max_size)]
+    def _stream_closed(self, session: StreamSession, transport: typing.Optional[asyncio.Transport]):
+        if transport is not None:
+            session.transports.discard(transport)
 
-            if request.transport is None:
-                break
+    def _block_sent(self, session: StreamSession, offset: int):
+        session.mark_downloaded(offset)
 
-            self._feed_stream_transport(local_token, request.transport)
+    async def _stream_handler(self, request: Request) -> typing.Optional[Response]:
+        stream_request = await self._parse_stream_request(request)
 
-            if request.transport.is_closing():
-                break
+        if isinstance(stream_request, Response):
+            return stream_request
 
-            await stream.write(block)
-            self._feed_downloaded_blocks(offset, local_token)
-            offset = new_offset
+        session = stream_request.session
+        document = stream_request.document
+        offset = stream_request.offset
+        data_to_skip = stream_request.data_to_skip
+        max_size = stream_request.max_size
+
+        stream = self._build_stream_response(stream_request)
+        await stream.prepare(request)
+
+        transport = request.transport
+        send_buffer_size = self._config.http.send_buffer_size
+
+        if transport is not None:
+            transport.set_write_buffer_limits(high=send_buffer_size)
+
+        windows = fetch_windows(offset, max_size, self._config.read_ahead.first_window_size, self._max_window_size,
+                                self._config.block_size)
+        read_ahead = ReadAhead(functools.partial(self._mtproto.get_block, document), windows, self._read_ahead_depth)
+        connection = (read_ahead, transport)
+        self._connections.add(connection)
+        self._stream_opened(session, transport)
+
+        block_size = self._config.block_size
+        # first block this response touches, it counts once the bytes sent reach its end
+        next_block = (offset + data_to_skip) // block_size * block_size
+
+        try:
+            while True:
+                self._sessions.touch(session)
+                result = await read_ahead.next()
+
+                if result is None:
+                    break
+
+                offset, block = result
+                view = memoryview(block)
+                new_offset = offset + len(view)
+
+                if new_offset > max_size:
+                    view = view[:len(view) - (new_offset - max_size)]
+
+                if data_to_skip:
+                    view = view[data_to_skip:]
+                    data_to_skip = False
+
+                if transport is None or transport.is_closing():
+                    break
+
+                # each write waits for the transport to drain below the watermark
+                for chunk_offset in range(0, len(view), send_buffer_size):
+                    await stream.write(view[chunk_offset:chunk_offset + send_buffer_size])
+
+                # windows can be smaller than a block, a block is only downloaded once sent up to its end
+                sent_until = min(new_offset, max_size)
+
+                while next_block < sent_until and min(next_block + block_size, document.size) <= sent_until:
+                    self._block_sent(session, next_block)
+                    next_block += block_size
+
+            await stream.write_eof()
+
+        except ConnectionResetError:
+            pass
+
+        finally:
+            read_ahead.close()
+            self._connections.discard(connection)
+            self._stream_closed(session, transport)
 
-        await stream.write_eof()
         stream.force_close()
 
         return stream
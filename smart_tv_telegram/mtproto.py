@@ -1,24 +1,23 @@
 import asyncio
+import collections
 import functools
 import logging
 import os
-import pickle
+import time
 import typing
 
 import pyrogram
 
-from async_lru import alru_cache
 from pyrogram.handlers.handler import Handler
-from pyrogram.raw.functions.auth import ExportAuthorization, ImportAuthorization
-from pyrogram.raw.functions.help import GetConfig
 from pyrogram.raw.functions.messages import GetMessages
-from pyrogram.raw.functions.upload import GetFile
-from pyrogram.raw.types import InputMessageID, Message, InputDocumentFileLocation
-from pyrogram.errors import FloodWait
-import pyrogram.session
-from pyrogram.raw.types.upload import File
+from pyrogram.raw.types import InputMessageID
+from pyrogram.errors import RPCError
 
 from . import Config
+from .block_cache import DiskBlockCache, MemoryBlockCache, SingleFlight
+from .document_cache import DocumentCache, DocumentMeta
+from .download_accounts import DownloadAccount, HelperDownloadAccount
+from .read_ahead import BlockType
 
 __all__ = [
     "Mtproto"
@@ -28,12 +27,34 @@ __all__ = [
 class Mtproto:
     _config: Config
     _client: pyrogram.Client
+    _disk_cache: typing.Optional[DiskBlockCache] = None
+    _memory_cache: MemoryBlockCache
+    _single_flight: SingleFlight
+    _document_cache: DocumentCache
+    _accounts: typing.List[DownloadAccount]
+    _relayed: typing.OrderedDict[int, int]
+    _relay_single_flight: SingleFlight
 
     def __init__(self, config: Config):
         self._config = config
         self._client = pyrogram.Client(config.session_name, config.api_id, config.api_hash,
                                        bot_token=config.token, sleep_threshold=0, workdir=os.getcwd())
 
+        self._memory_cache = MemoryBlockCache(config.download.cache.memory_max_size)
+        self._single_flight = SingleFlight()
+        self._document_cache = DocumentCache(self._get_messages, config.download.message_cache_ttl,
+                                             config.download.message_cache_size)
+        self._relayed = collections.OrderedDict()
+        self._relay_single_flight = SingleFlight()
+
+        # the first account is the bot itself, the helpers only download
+        self._accounts = [self._create_main_account()]
+        self._accounts.extend(self._create_helper_account(index, token)
+                              for index, token in enumerate(config.download.helpers.tokens))
+
+        if config.download.cache.disk_enabled:
+            self._disk_cache = DiskBlockCache(config.download.cache.disk_path, config.download.cache.disk_max_size)
+
     def register(self, handler: Handler):
         self._client.add_handler(handler)
 
@@ -45,22 +66,23 @@ class Mtproto:
             reply_to_message_id=message_id
         )
 
-    @alru_cache()
-    async def get_message(self, message_id: int) -> Message:
-        messages = await self._client.invoke(GetMessages(id=[InputMessageID(id=message_id)]))
+    async def _get_messages(self, message_ids: typing.List[int]) -> typing.List[typing.Any]:
+        messages = await self._client.invoke(GetMessages(id=[InputMessageID(id=x) for x in message_ids]))
+        return messages.messages
 
-        if not messages.messages:
-            raise ValueError("wrong message_id")
+    async def get_document(self, message_id: int) -> DocumentMeta:
+        return await self._document_cache.get(message_id)
 
-        message = messages.messages[0]
+    async def _refresh_file_reference(self, document: DocumentMeta):
+        fresh = await self._document_cache.load(document.message_id)
 
-        if not isinstance(message, Message):
-            raise ValueError(f"expected `Message`, found: `{type(message).__name__}`")
+        if fresh.id != document.id:
+            raise ValueError("document changed")
 
-        return message
+        document.file_reference = fresh.file_reference
 
     async def health_check(self):
-        if not all(x.is_started.is_set() for x in self._client.media_sessions.values()):
+        if not self._accounts[0].is_connected():
             logging.log(logging.ERROR, "media session not connected")
             raise ConnectionError()
 
@@ -68,66 +90,116 @@ class Mtproto:
             logging.log(logging.ERROR, "main session not connected")
             raise ConnectionError()
 
-    async def get_block(self, message: Message, offset: int, block_size: int) -> bytes:
-        session = self._client.media_sessions.get(message.media.document.dc_id)
-
-        request = GetFile(
-            offset=offset,
-            limit=block_size,
-            location=InputDocumentFileLocation(
-                id=message.media.document.id,
-                access_hash=message.media.document.access_hash,
-                file_reference=message.media.document.file_reference,
-                thumb_size=""
-            )
-        )
+    async def get_block(self, document: DocumentMeta, offset: int, block_size: int) -> BlockType:
+        key = (document.id, offset, block_size)
+        block = self._memory_cache.get(key)
 
-        result: typing.Optional[File] = None
+        if block is None:
+            aligned_offset = offset - (offset % self._config.block_size)
+            aligned_block = self._memory_cache.get((document.id, aligned_offset, self._config.block_size))
+            skip = offset - aligned_offset
 
-        while not isinstance(result, File):
-            try:
-                result = await session.invoke(request, sleep_threshold=0)
-            except FloodWait:  # file floodwait is fake
-                await asyncio.sleep(self._config.file_fake_fw_wait)
+            if aligned_block is not None and self._covers(aligned_block, skip, block_size, document.size - offset):
+                return memoryview(aligned_block)[skip:skip + block_size]
 
-        return result.bytes
+            load = functools.partial(self._load_block, document, offset, block_size)
+            block = await self._single_flight.run(key, load)
 
-    async def start(self):
-        await self._client.start()
+        return block
+
+    @staticmethod
+    def _covers(aligned_block: BlockType, skip: int, block_size: int, remaining: int) -> bool:
+        # the last block of the file is short, any other short slice would truncate the stream
+        return len(aligned_block) - skip >= min(block_size, remaining)
+
+    async def _load_block(self, document: DocumentMeta, offset: int, block_size: int) -> BlockType:
+        aligned_offset = offset - (offset % self._config.block_size)
+
+        if self._disk_cache is not None:
+            aligned_block = await self._disk_cache.get(document.id, aligned_offset)
+
+            if aligned_block is not None:
+                # keep the whole block, a cached view would pin it without being accounted
+                self._memory_cache.put((document.id, aligned_offset, self._config.block_size), aligned_block)
+                skip = offset - aligned_offset
+
+                if self._covers(aligned_block, skip, block_size, document.size - offset):
+                    return memoryview(aligned_block)[skip:skip + block_size]
+
+        block = await self._get_remote_block(document, offset, block_size)
+
+        if self._disk_cache is not None and offset == aligned_offset and block_size == self._config.block_size:
+            self._disk_cache.put(document.id, offset, block)
 
-        config = await self._client.invoke(GetConfig())
-        dc_ids = set(x.id for x in config.dc_options)
-        keys_path = self._config.session_name + ".keys"
+        self._memory_cache.put((document.id, offset, block_size), block)
+        return block
 
-        if os.path.exists(keys_path):
-            keys = pickle.load(open(keys_path, "rb"))
-        else:
-            keys = {}
+    def get_governors_state(self) -> typing.Dict[int, typing.Dict[str, float]]:
+        return self._accounts[0].get_governors_state()
 
-        for dc_id in dc_ids:
-            session = functools.partial(pyrogram.session.Session, self._client, dc_id, is_media=True, test_mode=False)
+    def get_accounts_state(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        return {account.name: account.get_state() for account in self._accounts}
 
-            if dc_id != await self._client.storage.dc_id():
-                if dc_id not in keys:
-                    exported_auth = await self._client.invoke(ExportAuthorization(dc_id=dc_id))
+    def _pick_account(self, dc_id: int) -> DownloadAccount:
+        now = time.monotonic()
+        healthy = [account for account in self._accounts if account.is_healthy(now)]
+        return min(healthy or self._accounts[:1], key=lambda account: account.score(dc_id))
 
-                    auth = pyrogram.session.Auth(self._client, dc_id, False)
-                    auth_key = await auth.create()
+    async def _get_remote_block(self, document: DocumentMeta, offset: int, block_size: int) -> bytes:
+        account = self._pick_account(document.dc_id)
+        main_account = self._accounts[0]
 
-                    session = session(auth_key)
-                    await session.start()
+        if account is main_account:
+            return await account.get_file(document, offset, block_size)
 
-                    await session.invoke(ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
-                    keys[dc_id] = session.auth_key
+        try:
+            return await account.get_file(document, offset, block_size)
 
-                else:
-                    session = session(keys[dc_id])
-                    await session.start()
+        except (RPCError, ValueError, OSError):
+            # the helper is benched by its own accounting, the main account serves this block
+            logging.log(logging.ERROR, "download account %s failed, falling back to %s",
+                        account.name, main_account.name, exc_info=True)
 
-            else:
-                session = session(await self._client.storage.auth_key())
-                await session.start()
+        return await main_account.get_file(document, offset, block_size)
+
+    async def _relay_document(self, document: DocumentMeta) -> int:
+        relay_message_id = self._relayed.get(document.id)
+
+        if relay_message_id is None:
+            relay_message_id = await self._relay_single_flight.run(document.id,
+                                                                   functools.partial(self._forward_to_relay, document))
+
+        return relay_message_id
+
+    async def _forward_to_relay(self, document: DocumentMeta) -> int:
+        message = await self._client.forward_messages(self._config.download.helpers.relay_chat, document.chat_id,
+                                                      document.message_id, disable_notification=True)
+        self._relayed[document.id] = message.id
+
+        while len(self._relayed) > self._config.download.message_cache_size:
+            self._relayed.popitem(last=False)
+
+        return message.id
+
+    async def _resolve_own(self, document: DocumentMeta, refresh: bool) -> DocumentMeta:
+        if refresh:
+            await self._refresh_file_reference(document)
+
+        return document
+
+    def _create_main_account(self) -> DownloadAccount:
+        return DownloadAccount("main", self._config, self._client, self._config.session_name, self._resolve_own)
+
+    def _create_helper_account(self, index: int, token: str) -> DownloadAccount:
+        return HelperDownloadAccount(f"helper{index}", self._config, token, self._relay_document)
+
+    async def start(self):
+        main_account, helpers = self._accounts[0], self._accounts[1:]
+        await main_account.start()
 
-            self._client.media_sessions[dc_id] = session
+        results = await asyncio.gather(*(account.start() for account in helpers), return_exceptions=True)
 
-        pickle.dump(keys, open(keys_path, "wb"))
+        for account, result in zip(helpers, results):
+            if isinstance(result, Exception):
+                logging.log(logging.ERROR, "download account %s not started: %s", account.name, result)
+                self._accounts.remove(account)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+import typing
+
+__all__ = [
+    "RateGovernor"
+]
+
+_FLOOD_DECREASE = 0.5
+_LATENCY_DECREASE = 0.9
+
+
+class RateGovernor:
+    _min_rate: float
+    _max_rate: float
+    _burst: float
+    _latency_target: float
+
+    _rate: float
+    _tokens: float
+    _updated: float
+    _paused_until: float
+    _waiting: int
+    _flood_waits: int
+    _lock: asyncio.Lock
+
+    def __init__(self, min_rate: float, max_rate: float, burst: float, latency_target: float):
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._burst = burst
+        self._latency_target = latency_target
+
+        self._rate = max_rate
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.
+        self._waiting = 0
+        self._flood_waits = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+    async def acquire(self):
+        self._waiting += 1
+
+        try:
+            # asyncio.Lock wakes its waiters in fifo order, every request gets its turn
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    if self._paused_until > now:
+                        await asyncio.sleep(self._paused_until - now)
+                        continue
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    await asyncio.sleep((1 - self._tokens) / self._rate)
+
+        finally:
+            self._waiting -= 1
+
+    def on_success(self, latency: float):
+        if latency > self._latency_target:
+            self._rate = max(self._min_rate, self._rate * _LATENCY_DECREASE)
+        else:
+            self._rate = min(self._max_rate, self._rate + 1 / self._rate)
+
+    def on_flood_wait(self, seconds: float):
+        now = time.monotonic()
+        self._refill(now)
+
+        self._flood_waits += 1
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._rate = max(self._min_rate, self._rate * _FLOOD_DECREASE)
+        self._tokens = 0
+        self._updated = self._paused_until  # no tokens are earned while paused
+
+    def get_backlog(self) -> float:
+        # seconds before a new request would get its token
+        return max(0., self._paused_until - time.monotonic()) + self._waiting / self._rate
+
+    def get_state(self) -> typing.Dict[str, float]:
+        return {
+            "rate": self._rate,
+            "min_rate": self._min_rate,
+            "max_rate": self._max_rate,
+            "burst": self._burst,
+            "tokens": self._tokens,
+            "paused_for": max(0., self._paused_until - time.monotonic()),
+            "waiting": self._waiting,
+            "flood_waits": self._flood_waits
+        }
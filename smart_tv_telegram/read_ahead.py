@@ -0,0 +1,95 @@
+import asyncio
+import collections
+import typing
+
+__all__ = [
+    "ReadAhead",
+    "FetchBlockType",
+    "BlockType",
+    "fetch_windows",
+    "FETCH_ALIGNMENT",
+    "FETCH_MAX_LIMIT"
+]
+
+BlockType = typing.Union[bytes, memoryview]
+FetchBlockType = typing.Callable[[int, int], typing.Awaitable[BlockType]]
+
+# upload.getFile: offset and limit divisible by 4 KiB, 1 MiB divisible by limit,
+# and a request can never cross a 1 MiB boundary
+FETCH_ALIGNMENT = 4096
+FETCH_MAX_LIMIT = 1024 * 1024
+
+
+def _floor_power_of_two(value: int) -> int:
+    return 1 << (value.bit_length() - 1)
+
+
+def fetch_windows(offset: int, end: int, first_window: int, max_window: int,
+                  block_size: int) -> typing.Iterator[typing.Tuple[int, int]]:
+    window = first_window
+
+    while offset < end:
+        needed = max(FETCH_ALIGNMENT, 1 << (end - offset - 1).bit_length())
+        boundary = FETCH_MAX_LIMIT - (offset % FETCH_MAX_LIMIT)
+        # a window never spans two cache blocks, a cached block must be able to serve it whole
+        block_boundary = block_size - (offset % block_size)
+        limit = _floor_power_of_two(min(window, needed, boundary, block_boundary))
+
+        yield offset, limit
+
+        offset += limit
+        window = min(window * 2, max_window)
+
+
+class ReadAhead:
+    _fetch: FetchBlockType
+    _windows: typing.Iterator[typing.Tuple[int, int]]
+    _depth: int
+    _pending: typing.Deque[typing.Tuple[int, asyncio.Future]]
+
+    def __init__(self, fetch: FetchBlockType, windows: typing.Iterable[typing.Tuple[int, int]], depth: int):
+        self._fetch = fetch
+        self._windows = iter(windows)
+        self._depth = depth
+        self._pending = collections.deque()
+
+    def _fill(self):
+        while len(self._pending) < self._depth:
+            try:
+                offset, limit = next(self._windows)
+            except StopIteration:
+                return
+
+            self._pending.append((offset, asyncio.ensure_future(self._fetch(offset, limit))))
+
+    def buffered_bytes(self) -> int:
+        return sum(
+            len(future.result())
+            for _, future in self._pending
+            if future.done() and not future.cancelled() and future.exception() is None
+        )
+
+    async def next(self) -> typing.Optional[typing.Tuple[int, BlockType]]:
+        self._fill()
+
+        if not self._pending:
+            return None
+
+        offset, future = self._pending[0]
+        block = await future
+
+        self._pending.popleft()
+        self._fill()
+
+        return offset, block
+
+    def close(self):
+        while self._pending:
+            _, future = self._pending.popleft()
+
+            if future.done():
+                if not future.cancelled():
+                    future.exception()  # avoid "exception was never retrieved"
+
+            else:
+                future.cancel()
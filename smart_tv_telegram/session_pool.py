@@ -0,0 +1,94 @@
+import time
+import typing
+
+import pyrogram.session
+from pyrogram.errors import RPCError
+from pyrogram.raw.core import TLObject
+
+__all__ = [
+    "MediaSessionPool",
+    "OnLatencyType"
+]
+
+OnLatencyType = typing.Callable[[float], None]
+
+_LATENCY_DECAY = 0.2
+_INITIAL_LATENCY = 0.5
+_FAILURE_DRAIN_TIME = 5.
+
+
+class _PooledSession:
+    __slots__ = ("session", "outstanding", "latency", "drained_until")
+
+    session: pyrogram.session.Session
+    outstanding: int
+    latency: float
+    drained_until: float
+
+    def __init__(self, session: pyrogram.session.Session):
+        self.session = session
+        self.outstanding = 0
+        self.latency = _INITIAL_LATENCY
+        self.drained_until = 0.
+
+    def is_usable(self, now: float) -> bool:
+        return self.drained_until <= now and self.session.is_started.is_set()
+
+    def score(self) -> float:
+        return (self.outstanding + 1) * self.latency
+
+
+class MediaSessionPool:
+    _dc_id: int
+    _sessions: typing.List[_PooledSession]
+
+    def __init__(self, dc_id: int, sessions: typing.Iterable[pyrogram.session.Session]):
+        self._dc_id = dc_id
+        self._sessions = [_PooledSession(session) for session in sessions]
+
+        if not self._sessions:
+            raise ValueError("empty media session pool")
+
+    @property
+    def dc_id(self) -> int:
+        return self._dc_id
+
+    def get_sessions(self) -> typing.List[pyrogram.session.Session]:
+        return [pooled.session for pooled in self._sessions]
+
+    def is_connected(self) -> bool:
+        return all(pooled.session.is_started.is_set() for pooled in self._sessions)
+
+    def _pick(self) -> _PooledSession:
+        now = time.monotonic()
+        usable = [pooled for pooled in self._sessions if pooled.is_usable(now)]
+        return min(usable or self._sessions, key=_PooledSession.score)
+
+    async def invoke(self, query: TLObject, on_latency: typing.Optional[OnLatencyType] = None) -> TLObject:
+        pooled = self._pick()
+        pooled.outstanding += 1
+        # one session answers its pipelined requests in turn, the wall time is shared by all of them
+        in_flight = pooled.outstanding
+        started = time.monotonic()
+
+        try:
+            result = await pooled.session.invoke(query, sleep_threshold=0)
+
+        except RPCError:
+            raise
+
+        except Exception:
+            pooled.drained_until = time.monotonic() + _FAILURE_DRAIN_TIME
+            raise
+
+        else:
+            elapsed = time.monotonic() - started
+            pooled.latency += (elapsed - pooled.latency) * _LATENCY_DECAY
+
+            if on_latency is not None:
+                on_latency(elapsed / in_flight)
+
+            return result
+
+        finally:
+            pooled.outstanding -= 1
@@ -0,0 +1,103 @@
+import asyncio
+import typing
+
+from .tools import InactivityWheel
+
+__all__ = [
+    "StreamSession",
+    "StreamSessionRegistry"
+]
+
+
+class StreamSession:
+    # the http side of a stream only, the bot and the devices keep their own state by local_token,
+    # released from OnStreamClosed once the session expires
+    __slots__ = ("local_token", "message_id", "chat_id", "size", "block_size", "blocks", "transports",
+                 "remote_streams")
+
+    local_token: int
+    message_id: int
+    chat_id: int
+    size: int
+    block_size: int
+    blocks: bytearray
+    transports: typing.Set[asyncio.Transport]
+    remote_streams: int
+
+    def __init__(self, local_token: int, message_id: int, chat_id: int, block_size: int):
+        self.local_token = local_token
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.size = 0
+        self.block_size = block_size
+        self.blocks = bytearray()
+        self.transports = set()
+        self.remote_streams = 0
+
+    def set_size(self, size: int):
+        if self.size != size:
+            self.size = size
+            self.blocks = bytearray((self.count_blocks() + 7) // 8)
+
+    def count_blocks(self) -> int:
+        return (self.size // self.block_size) + 1
+
+    def mark_downloaded(self, offset: int):
+        index = offset // self.block_size
+        self.blocks[index >> 3] |= 1 << (index & 7)
+
+    def count_downloaded(self) -> int:
+        return sum(bin(byte).count("1") for byte in self.blocks)
+
+    def remains_percent(self) -> float:
+        blocks = self.count_blocks()
+        return (blocks - self.count_downloaded()) / blocks * 100
+
+    def is_active(self) -> bool:
+        # remote_streams counts the responses served by the http worker processes
+        return self.remote_streams > 0 or any(not transport.is_closing() for transport in self.transports)
+
+
+class StreamSessionRegistry:
+    _sessions: typing.Dict[int, StreamSession]
+    _on_expired: typing.Callable[[StreamSession], typing.Coroutine]
+    _inactivity: InactivityWheel
+
+    def __init__(self, on_expired: typing.Callable[[StreamSession], typing.Coroutine], ttl: float):
+        self._sessions = {}
+        self._on_expired = on_expired
+        self._inactivity = InactivityWheel(self._sweep, ttl)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def start(self):
+        self._inactivity.start()
+
+    def add(self, session: StreamSession):
+        self._sessions[session.local_token] = session
+        self._inactivity.touch(session.local_token)
+
+    def get(self, local_token: int) -> typing.Optional[StreamSession]:
+        return self._sessions.get(local_token)
+
+    def touch(self, session: StreamSession):
+        self._inactivity.touch(session.local_token)
+
+    def remove(self, local_token: int) -> typing.Optional[StreamSession]:
+        self._inactivity.discard(local_token)
+        return self._sessions.pop(local_token, None)
+
+    async def _sweep(self, local_tokens: typing.List[int]):
+        for local_token in local_tokens:
+            session = self._sessions.get(local_token)
+
+            if session is None:
+                continue
+
+            if session.is_active():
+                self._inactivity.touch(local_token)
+                continue
+
+            del self._sessions[local_token]
+            await self._on_expired(session)
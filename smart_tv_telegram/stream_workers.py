@@ -0,0 +1,415 @@
+import asyncio
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import traceback
+import typing
+from multiprocessing.shared_memory import SharedMemory
+
+from aiohttp import web
+
+from . import Config, Mtproto, Http, StreamSessionObserver, DeviceFinderCollection
+from .document_cache import DocumentMeta
+from .read_ahead import FETCH_MAX_LIMIT
+from .stream_session import StreamSession
+
+__all__ = [
+    "StreamWorkers"
+]
+
+_LOGGER = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct("!I")
+_SUPERVISE_INTERVAL = 5
+
+FrameType = typing.Tuple[typing.Any, ...]
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> FrameType:
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    return pickle.loads(await reader.readexactly(_FRAME_HEADER.unpack(header)[0]))
+
+
+def _write_frame(writer: asyncio.StreamWriter, *frame: typing.Any):
+    if writer.is_closing():
+        return
+
+    payload = pickle.dumps(frame, pickle.HIGHEST_PROTOCOL)
+    writer.write(_FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def _slot_size(config: Config) -> int:
+    # the largest window a ReadAhead can ask for, see Http._max_window_size
+    return 1 << (min(config.block_size, FETCH_MAX_LIMIT).bit_length() - 1)
+
+
+class _WorkerConnection:
+    writer: asyncio.StreamWriter
+    attached: typing.Counter[int]
+    lent_slots: typing.Set[int]
+    tasks: typing.Set[asyncio.Future]
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.attached = collections.Counter()
+        self.lent_slots = set()
+        self.tasks = set()
+
+
+class StreamWorkers(StreamSessionObserver):
+    _mtproto: Mtproto
+    _config: Config
+    _http: Http
+    _slot_size: int
+    _memory: typing.Optional[SharedMemory] = None
+    _free_slots: asyncio.Queue
+    _socket_dir: typing.Optional[str] = None
+    _server: typing.Optional[asyncio.AbstractServer] = None
+    _supervisor: typing.Optional[asyncio.Task] = None
+    _processes: typing.List[multiprocessing.Process]
+    _connections: typing.Set[_WorkerConnection]
+    _sessions: typing.Dict[int, StreamSession]
+
+    def __init__(self, mtproto: Mtproto, config: Config, http: Http):
+        self._mtproto = mtproto
+        self._config = config
+        self._http = http
+        self._slot_size = _slot_size(config)
+        self._free_slots = asyncio.Queue()
+        self._processes = []
+        self._connections = set()
+        self._sessions = {}
+
+    def on_session_added(self, session: StreamSession):
+        self._sessions[session.local_token] = session
+
+        for connection in self._connections:
+            _write_frame(connection.writer, "token", session.local_token, session.message_id, session.chat_id)
+
+    def on_session_removed(self, local_token: int):
+        if self._sessions.pop(local_token, None) is None:
+            return
+
+        for connection in self._connections:
+            _write_frame(connection.writer, "revoke", local_token)
+
+    def _socket_path(self) -> str:
+        return os.path.join(self._socket_dir, "workers.sock")
+
+    async def start(self):
+        self._memory = SharedMemory(create=True, size=self._slot_size * self._config.http.workers.shared_blocks)
+
+        for slot in range(self._config.http.workers.shared_blocks):
+            self._free_slots.put_nowait(slot)
+
+        self._socket_dir = tempfile.mkdtemp(prefix="smart_tv_telegram_")
+        self._server = await asyncio.start_unix_server(self._serve_worker, self._socket_path())
+
+        self._processes = [self._spawn() for _ in range(self._config.http.workers.processes)]
+        self._supervisor = asyncio.get_event_loop().create_task(self._supervise())
+
+    def close(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+
+        for process in self._processes:
+            process.terminate()
+
+        if self._server is not None:
+            self._server.close()
+
+        for connection in self._connections:
+            connection.writer.close()
+
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+
+    def _spawn(self) -> multiprocessing.Process:
+        # spawn, a forked child would inherit the pyrogram client and the running event loop
+        process = multiprocessing.get_context("spawn").Process(
+            target=_worker_main,
+            args=(self._config, self._socket_path(), self._memory.name, logging.getLogger().getEffectiveLevel()),
+            daemon=True
+        )
+
+        process.start()
+        return process
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(_SUPERVISE_INTERVAL)
+
+            for position, process in enumerate(self._processes):
+                if not process.is_alive():
+                    _LOGGER.error("http worker %d exited with %s, restarting", process.pid, process.exitcode)
+                    self._processes[position] = self._spawn()
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _WorkerConnection(writer)
+        self._connections.add(connection)
+
+        for session in self._sessions.values():
+            _write_frame(writer, "token", session.local_token, session.message_id, session.chat_id)
+
+        try:
+            while True:
+                self._dispatch(connection, await _read_frame(reader))
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            self._connections.discard(connection)
+
+            for task in connection.tasks:
+                task.cancel()
+
+            for local_token, count in connection.attached.items():
+                session = self._sessions.get(local_token)
+
+                if session is not None:
+                    session.remote_streams -= count
+
+            for slot in connection.lent_slots:
+                self._free_slots.put_nowait(slot)
+
+            writer.close()
+
+    def _dispatch(self, connection: _WorkerConnection, frame: FrameType):
+        kind = frame[0]
+
+        if kind == "release":
+            connection.lent_slots.discard(frame[1])
+            self._free_slots.put_nowait(frame[1])
+            return
+
+        if kind in ("attach", "detach", "downloaded"):
+            self._update_session(connection, frame)
+            return
+
+        request_id = frame[1]
+
+        if kind == "document":
+            request = self._mtproto.get_document(frame[2])
+
+        elif kind == "block":
+            request = self._load_block(connection, *frame[2:])
+
+        elif kind == "health":
+            request = self._mtproto.health_check()
+
+        else:
+            _LOGGER.error("unknown http worker request %s", kind)
+            return
+
+        task = asyncio.ensure_future(self._reply(connection, request_id, request))
+        connection.tasks.add(task)
+        task.add_done_callback(connection.tasks.discard)
+
+    def _update_session(self, connection: _WorkerConnection, frame: FrameType):
+        kind, local_token = frame[0], frame[1]
+        session = self._sessions.get(local_token)
+
+        if session is None:
+            return
+
+        if kind == "attach":
+            session.set_size(frame[2])
+            session.remote_streams += 1
+            connection.attached[local_token] += 1
+
+        elif kind == "detach" and connection.attached[local_token]:
+            session.remote_streams -= 1
+            connection.attached[local_token] -= 1
+
+        elif kind == "downloaded":
+            session.mark_downloaded(frame[2])
+
+        self._http.touch_session(session)
+
+    async def _load_block(self, connection: _WorkerConnection, message_id: int, offset: int,
+                          block_size: int) -> typing.Tuple[int, int]:
+        if not 0 < block_size <= self._slot_size:
+            raise ValueError("block larger than a shared memory slot")
+
+        document = await self._mtproto.get_document(message_id)
+        block = await self._mtproto.get_block(document, offset, block_size)
+
+        slot = await self._free_slots.get()
+        connection.lent_slots.add(slot)
+
+        start = slot * self._slot_size
+        self._memory.buf[start:start + len(block)] = block
+
+        return slot, len(block)
+
+    @staticmethod
+    async def _reply(connection: _WorkerConnection, request_id: int, request: typing.Awaitable[typing.Any]):
+        try:
+            result = await request
+
+        except ValueError as error:
+            _write_frame(connection.writer, "error", request_id, False, str(error))
+
+        except Exception as error:
+            traceback.print_exc()
+            _write_frame(connection.writer, "error", request_id, True, repr(error))
+
+        else:
+            _write_frame(connection.writer, "result", request_id, result)
+
+
+class _MainProcessClient:
+    _reader: asyncio.StreamReader
+    _writer: asyncio.StreamWriter
+    _memory: SharedMemory
+    _slot_size: int
+    _requests: typing.Dict[int, typing.Tuple[str, asyncio.Future]]
+    _request_ids: typing.Iterator[int]
+    _on_push: typing.Callable[[FrameType], None]
+    _read_task: typing.Optional[asyncio.Task] = None
+
+    def __init__(self, memory: SharedMemory, slot_size: int, on_push: typing.Callable[[FrameType], None]):
+        self._memory = memory
+        self._slot_size = slot_size
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._on_push = on_push
+
+    async def connect(self, socket_path: str):
+        self._reader, self._writer = await asyncio.open_unix_connection(socket_path)
+        self._read_task = asyncio.get_event_loop().create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                frame = await _read_frame(self._reader)
+
+                if frame[0] == "result":
+                    self._resolve(frame[1], frame[2])
+
+                elif frame[0] == "error":
+                    _, request_id, connection_error, message = frame
+                    self._reject(request_id, ConnectionError(message) if connection_error else ValueError(message))
+
+                else:
+                    self._on_push(frame)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        except Exception:
+            traceback.print_exc()
+
+        # without the main process there is no mtproto client and no token to validate
+        _LOGGER.error("http worker %d lost the main process", os.getpid())
+        os._exit(1)
+
+    def _resolve(self, request_id: int, result: typing.Any):
+        kind, future = self._requests.pop(request_id)
+
+        if not future.done():
+            future.set_result(result)
+
+        elif kind == "block":
+            # the stream was closed while the block was in flight, give the slot back
+            self.send("release", result[0])
+
+    def _reject(self, request_id: int, error: Exception):
+        _, future = self._requests.pop(request_id)
+
+        if not future.done():
+            future.set_exception(error)
+
+    def send(self, *frame: typing.Any):
+        _write_frame(self._writer, *frame)
+
+    async def _request(self, kind: str, *args: typing.Any) -> typing.Any:
+        request_id = next(self._request_ids)
+        future = asyncio.get_event_loop().create_future()
+        # kept until the answer arrives even if cancelled, a late block answer still owns a slot
+        self._requests[request_id] = (kind, future)
+        self.send(kind, request_id, *args)
+        return await future
+
+    async def get_document(self, message_id: int) -> DocumentMeta:
+        return await self._request("document", message_id)
+
+    async def get_block(self, document: DocumentMeta, offset: int, block_size: int) -> bytes:
+        slot, length = await self._request("block", document.message_id, offset, block_size)
+        start = slot * self._slot_size
+
+        try:
+            return bytes(self._memory.buf[start:start + length])
+        finally:
+            self.send("release", slot)
+
+    async def health_check(self):
+        await self._request("health")
+
+
+class _WorkerHttp(Http):
+    _client: _MainProcessClient
+
+    def __init__(self, memory: SharedMemory, config: Config):
+        self._client = _MainProcessClient(memory, _slot_size(config), self._on_push)
+        # noinspection PyTypeChecker
+        super().__init__(self._client, config, DeviceFinderCollection())
+
+    def _on_push(self, frame: FrameType):
+        if frame[0] == "token":
+            _, local_token, message_id, chat_id = frame
+            self._sessions.add(StreamSession(local_token, message_id, chat_id, self._config.block_size))
+
+        elif frame[0] == "revoke":
+            self._sessions.remove(frame[1])
+
+    async def start(self):
+        # the sessions never expire here, the main process revokes them
+        app = web.Application()
+        self._add_stream_routes(app)
+
+        # noinspection PyProtectedMember
+        await web._run_app(app, host=self._config.listen_host, port=self._config.http.workers.port, reuse_port=True,
+                           print=None)
+
+    async def connect(self, socket_path: str):
+        await self._client.connect(socket_path)
+
+    def _stream_opened(self, session: StreamSession, transport: typing.Optional[asyncio.Transport]):
+        super()._stream_opened(session, transport)
+        self._client.send("attach", session.local_token, session.size)
+
+    def _stream_closed(self, session: StreamSession, transport: typing.Optional[asyncio.Transport]):
+        super()._stream_closed(session, transport)
+        self._client.send("detach", session.local_token)
+
+    def _block_sent(self, session: StreamSession, offset: int):
+        super()._block_sent(session, offset)
+        self._client.send("downloaded", session.local_token, offset)
+
+
+async def _run_worker(config: Config, socket_path: str, memory: SharedMemory):
+    http = _WorkerHttp(memory, config)
+    await http.connect(socket_path)
+    await http.start()
+
+
+def _worker_main(config: Config, socket_path: str, memory_name: str, log_level: int):
+    logging.basicConfig(level=log_level)
+    memory = SharedMemory(name=memory_name)
+
+    try:
+        asyncio.run(_run_worker(config, socket_path, memory))
+    finally:
+        memory.close()
@@ -1,8 +1,10 @@
 import asyncio
-import concurrent.futures
 import functools
+import math
 import re
 import secrets
+import time
+import traceback
 import typing
 
 from pyrogram.raw.types import MessageMediaDocument, Document, DocumentAttributeFilename
@@ -21,56 +23,95 @@ __all__ = [
     "secret_token",
     "base_url",
     "serialize_token",
-    "AsyncDebounce"
+    "InactivityWheel"
 ]
 
 _NAMED_MEDIA_TYPES = ("document", "video", "audio", "video_note", "animation")
 _RANGE_REGEX = re.compile(r"bytes=([0-9]+)-([0-9]+)?")
-_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-
-
-async def _debounce_wrap(
-        function: typing.Callable[..., typing.Coroutine],
-        args: typing.Tuple[typing.Any],
-        timeout: int,
-):
-    await asyncio.sleep(timeout)
-    await function(*args)
 
 
 def base_url(config: Config) -> str:
     return f"http://{config.listen_host}:{config.listen_port}"
 
 
-class AsyncDebounce:
-    _function: typing.Callable[..., typing.Coroutine]
-    _timeout: int
+class InactivityWheel:
+    _callback: typing.Callable[[typing.List[typing.Hashable]], typing.Coroutine]
+    _timeout: float
+    _resolution: float
+    _last_activity: typing.Dict[typing.Hashable, float]
+    _slots: typing.List[typing.Set[typing.Hashable]]
+    _position: int
     _task: typing.Optional[asyncio.Task] = None
-    _args: typing.Optional[typing.Tuple[typing.Any]] = None
 
-    def __init__(self, function: typing.Callable[..., typing.Coroutine], timeout: int):
-        self._function = function
+    def __init__(self,
+                 callback: typing.Callable[[typing.List[typing.Hashable]], typing.Coroutine],
+                 timeout: float,
+                 resolution: float = 1.):
+        self._callback = callback
         self._timeout = timeout
+        self._resolution = resolution
+        self._last_activity = {}
+        self._slots = [set() for _ in range(math.ceil(timeout / resolution) + 1)]
+        self._position = 0
+
+    def __len__(self) -> int:
+        return len(self._last_activity)
+
+    def _schedule(self, key: typing.Hashable, deadline: float, now: float):
+        ticks = max(1, math.ceil((deadline - now) / self._resolution))
+        self._slots[(self._position + min(ticks, len(self._slots) - 1)) % len(self._slots)].add(key)
+
+    def touch(self, key: typing.Hashable):
+        now = time.monotonic()
+
+        if key not in self._last_activity:
+            self._schedule(key, now + self._timeout, now)
+
+        self._last_activity[key] = now
+
+    def discard(self, key: typing.Hashable):
+        # the slot entry is dropped lazily when its tick comes
+        self._last_activity.pop(key, None)
+
+    def tick(self) -> typing.List[typing.Hashable]:
+        self._position = (self._position + 1) % len(self._slots)
+        slot = self._slots[self._position]
+        self._slots[self._position] = set()
+
+        now = time.monotonic()
+        expired = []
+
+        for key in slot:
+            last_activity = self._last_activity.get(key)
+
+            if last_activity is None:
+                continue
 
-    def _run(self) -> bool:
-        if self._args is None:
-            return False
+            deadline = last_activity + self._timeout
 
-        self._task = asyncio.get_event_loop().create_task(_debounce_wrap(self._function, self._args, self._timeout))
-        return True
+            if deadline <= now:
+                del self._last_activity[key]
+                expired.append(key)
+            else:
+                self._schedule(key, deadline, now)
 
-    def update_args(self, *args) -> bool:
-        if self._task is not None and self._task.done():
-            return False
+        return expired
 
-        if self._task is not None:
-            self._task.cancel()
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._resolution)
+            expired = self.tick()
 
-        self._args = args
-        return self._run()
+            if expired:
+                # noinspection PyBroadException
+                try:
+                    await self._callback(expired)
+                except Exception:
+                    traceback.print_exc()
 
-    def reschedule(self):
-        return self._run()
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
 
 
 def secret_token(nbytes: int = 8) -> int:
@@ -110,7 +151,7 @@ def mtproto_filename(message: TlMessage) -> str:
 
 
 def build_uri(config: Config, msg_id: int, token: int) -> str:
-    return f"http://{config.listen_host}:{config.listen_port}/stream/{msg_id}/{token}"
+    return f"http://{config.listen_host}:{config.http.stream_port}/stream/{msg_id}/{token}"
 
 
 def ascii_only(haystack: str) -> str:
@@ -119,7 +160,7 @@ def ascii_only(haystack: str) -> str:
 
 async def run_method_in_executor(func, *args, **kwargs):
     partial_function = functools.partial(func, *args, **kwargs)
-    return await asyncio.get_event_loop().run_in_executor(_EXECUTOR, partial_function)
+    return await asyncio.get_event_loop().run_in_executor(None, partial_function)
 
 
 def parse_http_range(http_range: str, block_size: int) -> typing.Tuple[int, int, typing.Optional[int]]:
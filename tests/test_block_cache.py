@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+from smart_tv_telegram.block_cache import DiskBlockCache
+
+_BLOCK = bytes(range(256)) * 16
+
+
+async def _put(cache: DiskBlockCache, document_id: int, offset: int, block: bytes = _BLOCK):
+    cache.put(document_id, offset, block)
+
+    # noinspection PyProtectedMember
+    while cache._tasks:
+        await asyncio.sleep(0.01)
+
+
+def test_index_is_recovered_after_restart(tmp_path):
+    async def fill():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        await _put(cache, 1, 0)
+        await _put(cache, -1001, len(_BLOCK), _BLOCK[::-1])
+
+    async def read():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        return await cache.get(1, 0), await cache.get(-1001, len(_BLOCK)), await cache.get(1, len(_BLOCK))
+
+    asyncio.run(fill())
+    assert asyncio.run(read()) == (_BLOCK, _BLOCK[::-1], None)
+
+
+def test_recovery_drops_damaged_entries_and_keeps_foreign_files(tmp_path):
+    async def fill():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        await _put(cache, 1, 0)
+        await _put(cache, 2, 0)
+        await _put(cache, 3, 0)
+
+    asyncio.run(fill())
+    blocks = tmp_path / "blocks"
+
+    os.remove(blocks / "1_0")
+    (blocks / "2_0").write_bytes(b"truncated")
+    (blocks / "4_0").write_bytes(_BLOCK)
+    (blocks / "5_0.tmp").write_bytes(b"partial")
+    (blocks / "notes.txt").write_text("not ours")
+    (tmp_path / "config.ini").write_text("not ours")
+
+    async def read():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        return [await cache.get(document_id, 0) for document_id in (1, 2, 3, 4)]
+
+    assert asyncio.run(read()) == [None, None, _BLOCK, None]
+    assert sorted(os.listdir(blocks)) == ["3_0", "index.pickle", "notes.txt"]
+    assert (tmp_path / "config.ini").exists()
+
+
+def test_corrupted_index_starts_cold(tmp_path):
+    async def fill():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        await _put(cache, 1, 0)
+
+    asyncio.run(fill())
+    (tmp_path / "blocks" / "index.pickle").write_bytes(b"garbage")
+
+    async def read():
+        cache = DiskBlockCache(str(tmp_path), 10 * len(_BLOCK))
+        return await cache.get(1, 0)
+
+    assert asyncio.run(read()) is None
+    assert not (tmp_path / "blocks" / "1_0").exists()
+
+
+def test_least_recently_used_block_is_evicted(tmp_path):
+    async def scenario():
+        cache = DiskBlockCache(str(tmp_path), 2 * len(_BLOCK))
+        await _put(cache, 1, 0)
+        await _put(cache, 2, 0)
+        assert await cache.get(1, 0) == _BLOCK
+
+        await _put(cache, 3, 0)
+        return [await cache.get(document_id, 0) for document_id in (1, 2, 3)]
+
+    assert asyncio.run(scenario()) == [_BLOCK, None, _BLOCK]
+    assert sorted(os.listdir(tmp_path / "blocks")) == ["1_0", "3_0", "index.pickle"]
+
+
+def test_shrinking_max_size_evicts_on_load(tmp_path):
+    async def fill():
+        cache = DiskBlockCache(str(tmp_path), 3 * len(_BLOCK))
+        await _put(cache, 1, 0)
+        await _put(cache, 2, 0)
+        await _put(cache, 3, 0)
+
+    async def read():
+        cache = DiskBlockCache(str(tmp_path), len(_BLOCK))
+        return [await cache.get(document_id, 0) for document_id in (1, 2, 3)]
+
+    asyncio.run(fill())
+    assert asyncio.run(read()) == [None, None, _BLOCK]
+
+
+def test_block_larger_than_the_cache_is_not_stored(tmp_path):
+    async def scenario():
+        cache = DiskBlockCache(str(tmp_path), len(_BLOCK) - 1)
+        await _put(cache, 1, 0)
+        return await cache.get(1, 0)
+
+    assert asyncio.run(scenario()) is None
+    assert not (tmp_path / "blocks" / "1_0").exists()
@@ -0,0 +1,180 @@
+import asyncio
+import configparser
+import typing
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from pyrogram.raw.types import Message, MessageMediaDocument, Document, PeerUser, DocumentAttributeFilename
+
+from smart_tv_telegram import Config, Http, DeviceFinderCollection
+from smart_tv_telegram.document_cache import DocumentMeta
+from smart_tv_telegram.tools import serialize_token
+
+_BLOCK_SIZE = 65536
+_SIZE = 3 * _BLOCK_SIZE + 1234
+_DATA = bytes(i % 251 for i in range(_SIZE))
+_MESSAGE_ID = 42
+_TOKEN = 1234
+
+
+class _MemoryMtproto:
+    _document: DocumentMeta
+
+    def __init__(self):
+        document = Document(
+            id=1,
+            access_hash=0,
+            file_reference=b"",
+            date=0,
+            mime_type="video/mp4",
+            size=_SIZE,
+            dc_id=2,
+            attributes=[DocumentAttributeFilename(file_name="video.mp4")]
+        )
+
+        self._document = DocumentMeta(Message(
+            id=_MESSAGE_ID,
+            peer_id=PeerUser(user_id=1),
+            date=0,
+            message="",
+            media=MessageMediaDocument(document=document)
+        ))
+
+    async def get_document(self, message_id: int) -> DocumentMeta:
+        if message_id != _MESSAGE_ID:
+            raise ValueError("message without document")
+
+        return self._document
+
+    async def get_block(self, _: DocumentMeta, offset: int, block_size: int) -> bytes:
+        return _DATA[offset:offset + block_size]
+
+
+def _write_config(path: str):
+    config = configparser.ConfigParser()
+    config["mtproto"] = {"api_id": "1", "api_hash": "0" * 32, "token": "0:test", "session_name": "test",
+                         "file_fake_fw_wait": "0.2"}
+    config["bot"] = {"admins": "[]", "block_size": str(_BLOCK_SIZE), "first_window_size": "4096",
+                     "request_gone_timeout": "900"}
+    config["http"] = {"listen_host": "127.0.0.1", "listen_port": "8350"}
+    config["web_ui"] = {"enabled": "0"}
+    config["discovery"] = {"upnp_enabled": "0", "chromecast_enabled": "0", "xbmc_enabled": "0", "vlc_enabled": "0",
+                           "device_request_timeout": "10"}
+
+    with open(path, "w") as file:
+        config.write(file)
+
+
+@pytest.fixture(name="http")
+def http_fixture(tmp_path) -> Http:
+    config_path = str(tmp_path / "config.ini")
+    _write_config(config_path)
+
+    # noinspection PyTypeChecker
+    http = Http(_MemoryMtproto(), Config(config_path), DeviceFinderCollection())
+    http.add_remote_token(_MESSAGE_ID, _TOKEN, 1)
+    return http
+
+
+def _request(http: Http, method: str, path: str, headers: typing.Dict[str, str]) -> typing.Tuple[int, dict, bytes]:
+    async def run():
+        app = web.Application()
+        # noinspection PyProtectedMember
+        http._add_stream_routes(app)
+
+        async with TestClient(TestServer(app)) as client:
+            async with client.request(method, path, headers=headers) as response:
+                return response.status, dict(response.headers), await response.read()
+
+    return asyncio.run(run())
+
+
+def _get(http: Http, headers: typing.Optional[typing.Dict[str, str]] = None) -> typing.Tuple[int, dict, bytes]:
+    return _request(http, "GET", f"/stream/{_MESSAGE_ID}/{_TOKEN}", headers or {})
+
+
+def test_full_document(http: Http):
+    status, headers, body = _get(http)
+
+    assert status == 200
+    assert headers["Content-Length"] == str(_SIZE)
+    assert headers["Accept-Ranges"] == "bytes"
+    assert body == _DATA
+
+
+@pytest.mark.parametrize("first, last", [
+    (0, 0),
+    (100, 199),
+    (4095, 4096),
+    (_BLOCK_SIZE - 10, _BLOCK_SIZE + 10),
+    (5000, _SIZE - 1)
+])
+def test_closed_range(http: Http, first: int, last: int):
+    status, headers, body = _get(http, {"Range": f"bytes={first}-{last}"})
+
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {first}-{last}/{_SIZE}"
+    assert headers["Content-Length"] == str(last - first + 1)
+    assert body == _DATA[first:last + 1]
+
+
+@pytest.mark.parametrize("first", [1, 4097, 2 * _BLOCK_SIZE + 17, _SIZE - 1])
+def test_open_ended_range(http: Http, first: int):
+    status, headers, body = _get(http, {"Range": f"bytes={first}-"})
+
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {first}-{_SIZE - 1}/{_SIZE}"
+    assert headers["Content-Length"] == str(_SIZE - first)
+    assert body == _DATA[first:]
+
+
+def test_range_end_past_the_document_is_clamped(http: Http):
+    status, headers, body = _get(http, {"Range": f"bytes=10-{_SIZE + 1000}"})
+
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 10-{_SIZE - 1}/{_SIZE}"
+    assert headers["Content-Length"] == str(_SIZE - 10)
+    assert body == _DATA[10:]
+
+
+def test_unsatisfiable_range(http: Http):
+    status, headers, body = _get(http, {"Range": f"bytes={_SIZE}-"})
+
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{_SIZE}"
+    assert headers["Access-Control-Allow-Origin"] == "*"
+    assert body == b""
+
+
+def test_malformed_range(http: Http):
+    status, _, _ = _get(http, {"Range": "bytes=-500"})
+    assert status == 400
+
+
+def test_head_matches_get_headers(http: Http):
+    status, headers, body = _request(http, "HEAD", f"/stream/{_MESSAGE_ID}/{_TOKEN}", {"Range": "bytes=100-"})
+
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 100-{_SIZE - 1}/{_SIZE}"
+    assert headers["Content-Length"] == str(_SIZE - 100)
+    assert body == b""
+
+
+def test_unknown_token(http: Http):
+    status, _, _ = _request(http, "GET", f"/stream/{_MESSAGE_ID}/{_TOKEN + 1}", {})
+    assert status == 403
+
+
+def test_partial_window_does_not_mark_its_block(http: Http):
+    # noinspection PyProtectedMember
+    session = http._sessions.get(serialize_token(_MESSAGE_ID, _TOKEN))
+
+    _get(http, {"Range": "bytes=0-4095"})
+    assert session.count_downloaded() == 0
+
+    _get(http, {"Range": f"bytes=0-{_BLOCK_SIZE - 1}"})
+    assert session.count_downloaded() == 1
+
+    _get(http)
+    assert session.count_downloaded() == session.count_blocks()
@@ -0,0 +1,59 @@
+import pytest
+
+from smart_tv_telegram.read_ahead import fetch_windows, FETCH_ALIGNMENT, FETCH_MAX_LIMIT
+
+_BLOCK_SIZE = 1048576
+_FIRST_WINDOW = 65536
+
+
+def _windows(offset: int, end: int, block_size: int = _BLOCK_SIZE):
+    return list(fetch_windows(offset, end, _FIRST_WINDOW, min(block_size, FETCH_MAX_LIMIT), block_size))
+
+
+@pytest.mark.parametrize("offset, end", [
+    (0, 10 * _BLOCK_SIZE),
+    (4096, 3 * _BLOCK_SIZE + 123),
+    (_BLOCK_SIZE - 4096, 2 * _BLOCK_SIZE),
+    (7 * 4096, 7 * 4096 + 1)
+])
+def test_windows_cover_the_range_contiguously(offset: int, end: int):
+    windows = _windows(offset, end)
+
+    assert windows[0][0] == offset
+    assert windows[-1][0] + windows[-1][1] >= end
+
+    for (previous_offset, previous_limit), (next_offset, _) in zip(windows, windows[1:]):
+        assert previous_offset + previous_limit == next_offset
+
+
+@pytest.mark.parametrize("offset", [0, 4096, 12288, _BLOCK_SIZE - 4096, 5 * _BLOCK_SIZE + 65536])
+def test_windows_are_4k_aligned_powers_of_two(offset: int):
+    for window_offset, limit in _windows(offset, offset + 4 * _BLOCK_SIZE):
+        assert window_offset % FETCH_ALIGNMENT == 0
+        assert limit % FETCH_ALIGNMENT == 0
+        assert limit & (limit - 1) == 0
+        assert limit <= FETCH_MAX_LIMIT
+
+
+@pytest.mark.parametrize("offset", [0, 4096, FETCH_MAX_LIMIT - 8192, 3 * FETCH_MAX_LIMIT - 4096])
+def test_windows_never_cross_a_1mib_boundary(offset: int):
+    for window_offset, limit in _windows(offset, offset + 4 * FETCH_MAX_LIMIT, block_size=4 * FETCH_MAX_LIMIT):
+        assert window_offset // FETCH_MAX_LIMIT == (window_offset + limit - 1) // FETCH_MAX_LIMIT
+
+
+@pytest.mark.parametrize("block_size", [131072, 262144, 524288])
+def test_windows_never_span_two_cache_blocks(block_size: int):
+    for window_offset, limit in _windows(block_size - 4096, 6 * block_size, block_size=block_size):
+        assert window_offset // block_size == (window_offset + limit - 1) // block_size
+
+
+def test_open_ended_stream_ramps_up_from_the_first_window():
+    limits = [limit for _, limit in _windows(0, 4 * _BLOCK_SIZE)]
+
+    assert limits[:5] == [65536, 131072, 262144, 524288, 65536]
+    assert limits[5:] == [_BLOCK_SIZE] * 3
+
+
+def test_short_range_uses_the_smallest_covering_window():
+    assert _windows(8192, 8192 + 100) == [(8192, 4096)]
+    assert _windows(0, 20000) == [(0, 32768)]